@@ -0,0 +1,89 @@
+"""
+Extraction benchmark: ZipFile.extractall against inflator's extract_zipball, on one thread and on several.
+
+Two synthetic zipballs are made: many small files, and a few large ones.
+
+    python benchmarks/extract.py --jobs 8 --runs 5
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import pathlib
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import zipfile
+
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT))
+
+from inflator.archive import extract_zipball  # noqa: E402
+
+PREFIX = "bench-archive-0000000"
+WORDS = [f"{w} " for w in ("costume", "sound", "proc", "func", "list", "var", "repeat", "until", "if", "else")]
+
+
+def content(size: int, rng: random.Random) -> bytes:
+    # compressible, like source code
+    return ''.join(rng.choices(WORDS, k=size // 6)).encode()[:size]
+
+
+def make_archive(path: pathlib.Path, count: int, size: int, seed: int = 0):
+    rng = random.Random(seed)
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr(f"{PREFIX}/", "")
+        for i in range(count):
+            archive.writestr(f"{PREFIX}/src/{i % 50}/file{i}.gs", content(size, rng))
+
+
+def extractall(archive: pathlib.Path, dest: pathlib.Path):
+    with zipfile.ZipFile(archive) as zf:
+        zf.extractall(dest)
+
+
+def timed(fn, archive: pathlib.Path, scratch: pathlib.Path, runs: int) -> float:
+    times = []
+    for _ in range(runs):
+        dest = scratch / "out"
+        shutil.rmtree(dest, ignore_errors=True)
+        start = time.perf_counter()
+        fn(archive, dest)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--jobs", type=int, default=min(8, os.cpu_count() or 1), help="Threads for the parallel run")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--small", type=int, nargs=2, default=[5000, 2048], metavar=("COUNT", "SIZE"),
+                        help="Files and bytes per file of the many-small-files archive")
+    parser.add_argument("--large", type=int, nargs=2, default=[8, 16 * 1024 ** 2], metavar=("COUNT", "SIZE"),
+                        help="Files and bytes per file of the few-large-files archive")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="inflate-extract-") as tmp:
+        scratch = pathlib.Path(tmp)
+        cases = {"many small": args.small, "few large": args.large}
+
+        print(f"{'archive':<12} {'files':>6} {'MiB':>8} {'extractall':>12} {'1 thread':>12} "
+              f"{f'{args.jobs} threads':>12}  (ms)")
+        for name, (count, size) in cases.items():
+            archive = scratch / f"{name.replace(' ', '-')}.zip"
+            make_archive(archive, count, size)
+
+            results = [
+                timed(extractall, archive, scratch, args.runs),
+                timed(lambda a, d: extract_zipball(a, d, include=["*"], jobs=1), archive, scratch, args.runs),
+                timed(lambda a, d: extract_zipball(a, d, include=["*"], jobs=args.jobs), archive, scratch, args.runs),
+            ]
+            print(f"{name:<12} {count:>6} {count * size / 1024 ** 2:>8.1f} "
+                  + ' '.join(f"{t * 1000:>12.1f}" for t in results))
+
+
+if __name__ == "__main__":
+    main()
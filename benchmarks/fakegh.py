@@ -0,0 +1,305 @@
+"""
+A local stand-in for the parts of the GitHub API that inflator uses, so benchmarks can run fully offline:
+
+- GET /repos/{owner}/{repo}/tags                         (paginated, with ETag / If-None-Match)
+- GET /repos/{owner}/{repo}/zipball/refs/tags/{tag}      (zipball with an '{owner}-{repo}-{sha}/' top folder)
+- GET /repos/inflated-goboscript/gtp/contents/gtp.json   (base64 encoded, with ETag / If-None-Match)
+- GET /repos/{owner}/{repo}/compare/{base}...{head}      (base and head are tags or commits)
+- GET /repos/{owner}/{repo}/git/blobs/{sha}              (raw with `Accept: application/vnd.github.raw+json`)
+- POST /graphql                                          (only aliased `repository(owner:, name:) { refs }` queries)
+
+Point inflator at it with `inflate set github-api http://127.0.0.1:<port>`.
+"""
+from __future__ import annotations
+
+import base64
+import hashlib
+import io
+import json
+import re
+import sys
+import threading
+import zipfile
+
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+GTP_PATH = "/repos/inflated-goboscript/gtp/contents/gtp.json"
+REPO_RE = re.compile(r"/repos/([^/]+)/([^/]+)")
+TAGS_RE = re.compile(r"/repos/([^/]+)/([^/]+)/tags")
+ZIPBALL_RE = re.compile(r"/repos/([^/]+)/([^/]+)/zipball/refs/tags/(.+)")
+COMPARE_RE = re.compile(r"/repos/([^/]+)/([^/]+)/compare/(.+)\.\.\.(.+)")
+BLOB_RE = re.compile(r"/repos/([^/]+)/([^/]+)/git/blobs/([0-9a-f]{40})")
+GRAPHQL_REPO_RE = re.compile(r'(\w+): repository\(owner: ("(?:[^"\\]|\\.)*"), name: ("(?:[^"\\]|\\.)*")\)')
+GRAPHQL_FIRST_RE = re.compile(r"refs\(refPrefix: \"refs/tags/\", first: (\d+)\)")
+
+
+def commit_sha(owner: str, repo: str, tag: str) -> str:
+    return hashlib.sha1(f"{owner}/{repo}@{tag}".encode()).hexdigest()
+
+
+def blob_sha(content: bytes) -> str:
+    return hashlib.sha1(b"blob %d\0" % len(content) + content).hexdigest()
+
+
+class FakeGitHub:
+    """
+    Holds repos as {(owner, repo): {tag: {path: bytes}}}, newest tag first, and serves them over HTTP
+    """
+    def __init__(self, page_size: int = 100, fail_every: int = 0):
+        self.repos: dict[tuple[str, str], dict[str, dict[str, bytes]]] = {}
+        self.gtp: dict[str, dict[str, str]] = {}
+        # repos that only requests with an Authorization header can see
+        self.private: set[tuple[str, str]] = set()
+        self.page_size = page_size
+        # answer every nth request with a 503, to imitate a flaky connection
+        self.fail_every = fail_every
+        # requests served, by kind: "repo", "tags", "zipball", "gtp", "graphql", "compare", "blob", "not-modified",
+        # "missing", "failed"
+        self.requests: Counter[str] = Counter()
+
+        self._zipballs: dict[tuple[str, str, str], bytes] = {}
+        self._served = 0
+        self._lock = threading.Lock()
+        self._server: ThreadingHTTPServer | None = None
+
+    def count(self, kind: str):
+        with self._lock:
+            self.requests[kind] += 1
+
+    def should_fail(self) -> bool:
+        with self._lock:
+            self._served += 1
+            if self.fail_every and self._served % self.fail_every == 0:
+                self.requests["failed"] += 1
+                return True
+            return False
+
+    def add(self, owner: str, repo: str, tag: str, files: dict[str, bytes | str]):
+        self.repos.setdefault((owner, repo), {})[tag] = {
+            path: content.encode() if isinstance(content, str) else content for path, content in files.items()}
+
+    def zipball(self, owner: str, repo: str, tag: str) -> bytes:
+        key = owner, repo, tag
+        with self._lock:
+            if key not in self._zipballs:
+                prefix = f"{owner}-{repo}-{commit_sha(owner, repo, tag)[:7]}/"
+                buf = io.BytesIO()
+                with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as archive:
+                    archive.writestr(prefix, "")
+                    for path, content in self.repos[owner, repo][tag].items():
+                        archive.writestr(prefix + path, content)
+                self._zipballs[key] = buf.getvalue()
+            return self._zipballs[key]
+
+    def find_ref(self, owner: str, repo: str, ref: str) -> str | None:
+        # a tag name, or a (short) commit sha of one
+        tags = self.repos.get((owner, repo), {})
+        if ref in tags:
+            return ref
+        return next((tag for tag in tags if commit_sha(owner, repo, tag).startswith(ref)), None)
+
+    def compare(self, owner: str, repo: str, base: str, head: str) -> dict:
+        # Tags are ordered newest first, and each is taken to be one commit after the next older one
+        names = list(self.repos[owner, repo])
+        base_i, head_i = names.index(base), names.index(head)
+        old, new = self.repos[owner, repo][base], self.repos[owner, repo][head]
+
+        files = []
+        for path in sorted(old.keys() | new.keys()):
+            if path not in new:
+                files.append({"filename": path, "status": "removed", "sha": blob_sha(old[path])})
+            elif path not in old:
+                files.append({"filename": path, "status": "added", "sha": blob_sha(new[path])})
+            elif old[path] != new[path]:
+                files.append({"filename": path, "status": "modified", "sha": blob_sha(new[path])})
+
+        commits = [{"sha": commit_sha(owner, repo, tag)} for tag in reversed(names[head_i:base_i])]
+        status = "identical" if base_i == head_i else "ahead" if head_i < base_i else "behind"
+        return {"status": status, "ahead_by": len(commits), "total_commits": len(commits), "commits": commits,
+                "files": files[:300]}
+
+    def blob(self, owner: str, repo: str, sha: str) -> bytes | None:
+        for files in self.repos.get((owner, repo), {}).values():
+            for content in files.values():
+                if blob_sha(content) == sha:
+                    return content
+        return None
+
+    @property
+    def url(self) -> str:
+        assert self._server is not None, "Server not started"
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """
+        Serve in a background thread. Port 0 picks a free port.
+        :return: base url to use as the github-api cookie
+        """
+        fake = self
+
+        class Handler(_Handler):
+            github = fake
+
+        self._server = _Server((host, port), Handler)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self.url
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # clients closing kept-alive connections when they exit isn't worth a traceback
+        if not isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            super().handle_error(request, client_address)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    github: FakeGitHub
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, body: bytes = b"", content_type: str = "application/json",
+              headers: dict[str, str] | None = None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, data, headers: dict[str, str] | None = None):
+        body = json.dumps(data).encode()
+        etag = f'"{hashlib.sha1(body).hexdigest()}"'
+
+        if self.headers.get("If-None-Match") == etag:
+            self.github.count("not-modified")
+            self._send(304, headers={"ETag": etag})
+        else:
+            self._send(200, body, headers={"ETag": etag, **(headers or {})})
+
+    def _visible(self, owner: str, repo: str) -> bool:
+        return (owner, repo) in self.github.repos and \
+            ((owner, repo) not in self.github.private or bool(self.headers.get("Authorization")))
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        github = self.github
+
+        if github.should_fail():
+            return self._send(503, b'{"message": "Service Unavailable"}')
+
+        if url.path == GTP_PATH:
+            github.count("gtp")
+            content = base64.b64encode(json.dumps(github.gtp).encode()).decode()
+            return self._send_json({"name": "gtp.json", "encoding": "base64", "content": content})
+
+        if match := REPO_RE.fullmatch(url.path):
+            owner, repo = match.groups()
+            if not self._visible(owner, repo):
+                github.count("missing")
+                return self._send(404, b'{"message": "Not Found"}')
+
+            github.count("repo")
+            return self._send_json({"full_name": f"{owner}/{repo}", "private": (owner, repo) in github.private})
+
+        if match := TAGS_RE.fullmatch(url.path):
+            owner, repo = match.groups()
+            if not self._visible(owner, repo):
+                github.count("missing")
+                return self._send(404, b'{"message": "Not Found"}')
+
+            github.count("tags")
+            query = parse_qs(url.query)
+            per_page = min(int(query.get("per_page", [github.page_size])[0]), github.page_size)
+            page = int(query.get("page", ["1"])[0])
+
+            names = list(github.repos[owner, repo])
+            chunk = names[(page - 1) * per_page:page * per_page]
+            headers = {}
+            if page * per_page < len(names):
+                headers["Link"] = f'<{github.url}{url.path}?per_page={per_page}&page={page + 1}>; rel="next"'
+
+            return self._send_json([{"name": tag, "commit": {"sha": commit_sha(owner, repo, tag)}} for tag in chunk],
+                                   headers)
+
+        if match := ZIPBALL_RE.fullmatch(url.path):
+            owner, repo, tag = match.groups()
+            if not self._visible(owner, repo) or tag not in github.repos[owner, repo]:
+                github.count("missing")
+                return self._send(404, b'{"message": "Not Found"}')
+
+            github.count("zipball")
+            return self._send(200, github.zipball(owner, repo, tag), "application/zip")
+
+        if match := COMPARE_RE.fullmatch(url.path):
+            owner, repo, base, head = match.groups()
+            base, head = github.find_ref(owner, repo, base), github.find_ref(owner, repo, head)
+            if not self._visible(owner, repo) or base is None or head is None:
+                github.count("missing")
+                return self._send(404, b'{"message": "Not Found"}')
+
+            github.count("compare")
+            return self._send_json(github.compare(owner, repo, base, head))
+
+        if match := BLOB_RE.fullmatch(url.path):
+            content = github.blob(*match.groups())
+            if not self._visible(match[1], match[2]) or content is None:
+                github.count("missing")
+                return self._send(404, b'{"message": "Not Found"}')
+
+            github.count("blob")
+            if "raw" in self.headers.get("Accept", ""):
+                return self._send(200, content, "application/vnd.github.raw")
+            return self._send_json({"sha": match[3], "size": len(content), "encoding": "base64",
+                                    "content": base64.b64encode(content).decode()})
+
+        github.count("missing")
+        self._send(404, b'{"message": "Not Found"}')
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        github = self.github
+
+        if github.should_fail():
+            return self._send(503, b'{"message": "Service Unavailable"}')
+
+        if urlsplit(self.path).path != "/graphql":
+            github.count("missing")
+            return self._send(404, b'{"message": "Not Found"}')
+        if not self.headers.get("Authorization"):
+            github.count("missing")
+            return self._send(401, b'{"message": "This endpoint requires you to be authenticated."}')
+
+        github.count("graphql")
+        query = json.loads(body)["query"]
+        first = int(match[1]) if (match := GRAPHQL_FIRST_RE.search(query)) else 100
+
+        data, errors = {}, []
+        for alias, owner, repo in GRAPHQL_REPO_RE.findall(query):
+            owner, repo = json.loads(owner), json.loads(repo)
+            if (owner, repo) not in github.repos:
+                data[alias] = None
+                errors.append({"type": "NOT_FOUND", "path": [alias],
+                               "message": f"Could not resolve to a Repository with the name '{owner}/{repo}'."})
+                continue
+
+            names = list(github.repos[owner, repo])
+            data[alias] = {"refs": {
+                "nodes": [{"name": tag, "target": {"oid": commit_sha(owner, repo, tag)}} for tag in names[:first]],
+                "pageInfo": {"hasNextPage": len(names) > first},
+            }}
+
+        self._send(200, json.dumps({"data": data, **({"errors": errors} if errors else {})}).encode())
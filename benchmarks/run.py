@@ -0,0 +1,161 @@
+"""
+Scaling benchmark for inflate, fully offline.
+
+For each size, generates a synthetic package graph (see synth.py), serves it from a local fake GitHub (see fakegh.py)
+and times these in a fresh, isolated HOME:
+
+- install-cold:    `inflate install -r inflator.toml` with nothing cached
+- install-warm:    the same after deleting the package store and inflator.lock, but keeping the download cache
+- install-locked:  the same after deleting the package store, installing from inflator.lock
+- install-noop:    the same with everything already installed
+- sync:            `inflate` in the project
+- find:            `inflate find`, listing every installed package
+- search:          search_for_package() in-process, for a mix of exact, globbed and listing queries
+
+    python benchmarks/run.py --sizes 10 100 1000 --json results.json
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import pathlib
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from typing import Optional
+
+import synth
+from fakegh import FakeGitHub
+
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+
+CLI = "import sys; from inflator.__main__ import main; sys.argv[0] = 'inflate'; main()"
+
+SEARCH = """
+import sys, time
+from inflator.package import search_for_package
+
+queries = [("bench", "pkg0", "v1.0.0"), (None, "pkg1*", None), ("bench", None, "v1.*"), (None, None, None)]
+start = time.perf_counter()
+for _ in range(int(sys.argv[1])):
+    for query in queries:
+        search_for_package(*query)
+print(time.perf_counter() - start)
+"""
+
+STEPS = ("install-cold", "install-warm", "install-locked", "install-noop", "sync", "find", "search")
+
+
+class Bench:
+    """
+    One isolated inflate environment: a HOME (so a separate package store, cache and cookies.json) and a project
+    """
+    def __init__(self, home: pathlib.Path, api: str, token: Optional[str] = None):
+        self.home = home
+        self.project = home / "project"
+        self.project.mkdir(parents=True)
+
+        self.env = dict(os.environ, HOME=str(home), APPDATA=str(home), PYTHONPATH=str(ROOT))
+
+        self.inflate_dir = home / ".faretek" / "inflate"
+        self.inflate_dir.mkdir(parents=True)
+        cookies = {"github-api": api}
+        if token:
+            # makes inflate prefetch tags with GraphQL
+            cookies["auth-token"] = token
+        (self.inflate_dir / "cookies.json").write_text(json.dumps(cookies))
+
+    def python(self, *args: str) -> tuple[float, str]:
+        start = time.perf_counter()
+        proc = subprocess.run([sys.executable, *args], cwd=self.project, env=self.env, capture_output=True, text=True)
+        elapsed = time.perf_counter() - start
+
+        if proc.returncode:
+            raise RuntimeError(f"{args} failed:\n{proc.stdout}\n{proc.stderr}")
+        return elapsed, proc.stdout
+
+    def inflate(self, *args: str) -> float:
+        return self.python("-c", CLI, *args)[0]
+
+    def wipe_store(self):
+        shutil.rmtree(self.inflate_dir / "pkgs", ignore_errors=True)
+        (self.inflate_dir / "index.json").unlink(missing_ok=True)
+
+
+def bench_size(size: int, args: argparse.Namespace) -> dict[str, float]:
+    graph = synth.make_graph(size, depth=args.depth, width=args.width, diamond=args.diamond, versions=args.versions,
+                             seed=args.seed)
+    github = FakeGitHub(fail_every=args.fail_every)
+    synth.publish(graph, github, file_count=args.files, file_size=args.file_size)
+    api = github.start()
+
+    results = {}
+    try:
+        with tempfile.TemporaryDirectory(prefix="inflate-bench-") as tmp:
+            bench = Bench(pathlib.Path(tmp), api, "bench-token" if args.graphql else None)
+            roots = [graph.packages[name] for name in graph.roots]
+            (bench.project / "inflator.toml").write_text(synth.manifest(roots))
+
+            install = ("install", "-r", "inflator.toml", "-j", str(args.jobs))
+
+            results["install-cold"] = bench.inflate(*install)
+
+            bench.wipe_store()
+            (bench.project / "inflator.lock").unlink()
+            results["install-warm"] = bench.inflate(*install)
+
+            bench.wipe_store()
+            results["install-locked"] = bench.inflate(*install)
+
+            results["install-noop"] = bench.inflate(*install)
+            results["sync"] = bench.inflate()
+            results["find"] = bench.inflate("find")
+            results["search"] = float(bench.python("-c", SEARCH, str(args.search_runs))[1]) / args.search_runs
+    finally:
+        github.stop()
+
+    results["packages"] = len(graph.packages)
+    results["edges"] = graph.edges
+    results["requests"] = dict(github.requests)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000], help="Graph sizes, in packages")
+    parser.add_argument("--jobs", type=int, default=8, help="inflate install -j")
+    parser.add_argument("--depth", type=int, default=4, help="Layers in the graph")
+    parser.add_argument("--width", type=int, default=3, help="Dependencies per package")
+    parser.add_argument("--diamond", type=float, default=0.5,
+                        help="How much dependencies are shared, from 0 (a tree, as far as possible) to 1")
+    parser.add_argument("--versions", type=int, default=2, help="Tags per package")
+    parser.add_argument("--files", type=int, default=5, help=".gs files per package")
+    parser.add_argument("--file-size", type=int, default=2048, help="Size of each .gs file in bytes")
+    parser.add_argument("--search-runs", type=int, default=20, help="Repetitions of the search queries")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--fail-every", type=int, default=0, metavar="N",
+                        help="Make the fake GitHub answer every Nth request with a 503")
+    parser.add_argument("--graphql", action="store_true",
+                        help="Set an auth-token, so that tags are fetched in batches with GraphQL instead of REST")
+    parser.add_argument("--json", metavar="FILE", help="Also write the results to FILE")
+    args = parser.parse_args()
+
+    all_results = {}
+    print(f"{'packages':>8} {'edges':>6} " + ' '.join(f"{step:>14}" for step in STEPS) + "  (ms)")
+    for size in args.sizes:
+        results = all_results[size] = bench_size(size, args)
+        print(f"{results['packages']:>8} {results['edges']:>6} "
+              + ' '.join(f"{results[step] * 1000:>14.1f}" for step in STEPS))
+        print(f"{'':>16}requests: {results['requests']}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "results": all_results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+"""
+Fleet benchmark for `inflate serve`, fully offline: several clients install the same project at once, straight from
+the fake GitHub and then through one `inflate serve` in front of it, and the requests that reach GitHub are counted.
+
+    python benchmarks/serve.py --clients 4 --size 50
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import pathlib
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import run
+import synth
+from fakegh import FakeGitHub
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def fleet(api: str, manifest: str, clients: int) -> float:
+    # Install the project on every client at once. Returns the wall time
+    benches = [run.Bench(pathlib.Path(tempfile.mkdtemp(prefix="inflate-fleet-")), api) for _ in range(clients)]
+    for bench in benches:
+        (bench.project / "inflator.toml").write_text(manifest)
+
+    threads = [threading.Thread(target=bench.inflate, args=("install", "-r", "inflator.toml")) for bench in benches]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clients", type=int, default=4, help="Machines installing at the same time")
+    parser.add_argument("--size", type=int, default=50, help="Packages in the project's graph")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", metavar="FILE", help="Also write the results to FILE")
+    args = parser.parse_args()
+
+    graph = synth.make_graph(args.size, seed=args.seed)
+    github = FakeGitHub()
+    synth.publish(graph, github)
+    upstream = github.start()
+    manifest = synth.manifest([graph.packages[name] for name in graph.roots])
+
+    results = {}
+    try:
+        results["direct"] = {"ms": round(fleet(upstream, manifest, args.clients) * 1000, 1),
+                             "upstream": dict(github.requests)}
+        github.requests.clear()
+
+        # the proxy gets its own HOME, so nothing is shared with the clients but the network
+        port = free_port()
+        env = dict(os.environ, HOME=tempfile.mkdtemp(prefix="inflate-serve-"), PYTHONPATH=str(run.ROOT))
+        proxy = subprocess.Popen([sys.executable, "-c", run.CLI, "serve", "-p", str(port), "--upstream", upstream],
+                                 env=env, stdout=subprocess.PIPE, text=True)
+        try:
+            proxy.stdout.readline()  # started
+            results["proxied"] = {"ms": round(fleet(f"http://127.0.0.1:{port}", manifest, args.clients) * 1000, 1),
+                                  "upstream": dict(github.requests)}
+        finally:
+            proxy.terminate()
+            proxy.wait()
+    finally:
+        github.stop()
+
+    print(f"{args.clients} clients installing {args.size} packages")
+    for mode, result in results.items():
+        print(f"{mode:>8}: {result['ms']:>9} ms  upstream requests: {result['upstream']}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
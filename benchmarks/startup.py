@@ -0,0 +1,80 @@
+"""
+Startup-time benchmark for the inflate CLI.
+
+Runs `inflate -V` and `inflate -L` in fresh interpreters with `-X importtime`, reports how long importing took and
+fails if any heavy module got imported. Exits non-zero on failure, so it can be used in CI:
+
+    python benchmarks/startup.py --runs 20 --budget-ms 60
+"""
+from __future__ import annotations
+
+import argparse
+import pathlib
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = pathlib.Path(__file__).resolve().parents[1]
+
+# Only subcommands that talk to the network or make new projects should need these
+HEAVY_MODULES = ("httpx", "httpcore", "furl", "github", "slugify", "h2")
+
+CLI = "import sys; from inflator.__main__ import main; sys.argv[0] = 'inflate'; main()"
+IMPORTTIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)")
+
+
+def run(args: list[str], importtime: bool = False) -> tuple[float, str]:
+    cmd = [sys.executable, *(["-X", "importtime"] if importtime else []), "-c", CLI, *args]
+
+    start = time.perf_counter()
+    proc = subprocess.run(cmd, cwd=ROOT, capture_output=True, text=True, check=True)
+    return time.perf_counter() - start, proc.stderr
+
+
+def imported_modules(stderr: str) -> dict[str, int]:
+    """
+    :return: cumulative import time in microseconds of every module, from -X importtime output
+    """
+    ret = {}
+    for line in stderr.splitlines():
+        if match := IMPORTTIME_LINE.match(line):
+            ret[match[4]] = int(match[2])
+    return ret
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=10, help="Number of timed runs of each command")
+    parser.add_argument("--budget-ms", type=float, default=None,
+                        help="Fail if the median wall-clock time of a command is above this")
+    parser.add_argument("--top", type=int, default=10, help="Number of slowest imports to show")
+    args = parser.parse_args()
+
+    ok = True
+    for cli_args in (["-V"], ["-L"]):
+        name = f"inflate {' '.join(cli_args)}"
+
+        modules = imported_modules(run(cli_args, importtime=True)[1])
+        heavy = sorted(m for m in modules if m.split('.')[0] in HEAVY_MODULES)
+        times = sorted(run(cli_args)[0] * 1000 for _ in range(args.runs))
+        median = statistics.median(times)
+
+        print(f"{name}: median {median:.1f} ms, min {times[0]:.1f} ms over {args.runs} runs, "
+              f"{len(modules)} modules imported")
+        for module, us in sorted(modules.items(), key=lambda i: i[1], reverse=True)[:args.top]:
+            print(f"    {us / 1000:8.2f} ms  {module}")
+
+        if heavy:
+            print(f"  FAIL: imported heavy modules {heavy}")
+            ok = False
+        if args.budget_ms is not None and median > args.budget_ms:
+            print(f"  FAIL: over budget of {args.budget_ms} ms")
+            ok = False
+
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
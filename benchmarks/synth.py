@@ -0,0 +1,110 @@
+"""
+Synthetic goboscript package graphs for benchmarks.
+
+Packages are arranged in `depth` layers. Each package depends on `width` packages of the next layer, and
+`diamond` controls how much those dependencies are shared: at 0 every layer is as wide as it can be, at 1 every
+package in a layer depends on the same few packages.
+"""
+from __future__ import annotations
+
+import random
+
+from dataclasses import dataclass, field
+
+from fakegh import FakeGitHub
+
+OWNER = "bench"
+
+
+@dataclass
+class SyntheticPackage:
+    name: str
+    layer: int
+    deps: list[str] = field(default_factory=list)
+    # every tag, newest first
+    tags: list[str] = field(default_factory=list)
+
+    @property
+    def url(self):
+        return f"https://github.com/{OWNER}/{self.name}"
+
+
+@dataclass
+class Graph:
+    packages: dict[str, SyntheticPackage]
+    roots: list[str]
+
+    @property
+    def edges(self):
+        return sum(len(pkg.deps) for pkg in self.packages.values())
+
+
+def make_graph(count: int, *, depth: int = 4, width: int = 3, diamond: float = 0.5, versions: int = 1,
+               seed: int = 0) -> Graph:
+    rng = random.Random(seed)
+    depth = max(1, min(depth, count))
+
+    # Layer sizes grow geometrically, shrunk towards a constant as diamond goes up (more sharing)
+    growth = max(1.0, width * (1 - diamond))
+    weights = [growth ** i for i in range(depth)]
+    sizes = [max(1, round(count * w / sum(weights))) for w in weights]
+    sizes[-1] += count - sum(sizes)
+    while sizes[-1] < 1:
+        # rounding gave earlier layers too much
+        biggest = max(range(depth - 1), key=lambda i: sizes[i])
+        sizes[biggest] -= 1
+        sizes[-1] += 1
+
+    layers: list[list[SyntheticPackage]] = []
+    n = 0
+    for layer, size in enumerate(sizes):
+        layers.append([])
+        for _ in range(size):
+            pkg = SyntheticPackage(f"pkg{n}", layer,
+                                   tags=[f"v1.{versions - 1 - v}.0" for v in range(versions)])
+            layers[-1].append(pkg)
+            n += 1
+
+    for upper, lower in zip(layers, layers[1:]):
+        for pkg in upper:
+            pkg.deps = [dep.name for dep in rng.sample(lower, min(width, len(lower)))]
+
+        # make sure everything is reachable
+        used = {dep for pkg in upper for dep in pkg.deps}
+        for dep in lower:
+            if dep.name not in used:
+                rng.choice(upper).deps.append(dep.name)
+
+    packages = {pkg.name: pkg for layer in layers for pkg in layer}
+    return Graph(packages, [pkg.name for pkg in layers[0]])
+
+
+def manifest(deps: list[SyntheticPackage], *, name: str = "project", gtp: bool = False) -> str:
+    """
+    inflator.toml depending on deps with a glob version. With gtp, deps are referred to by their gtp name
+    """
+    lines = [f'name = "{name}"', 'version = "v1.0.0"', f'username = "{OWNER}"', "", "[dependencies]"]
+    for dep in deps:
+        lines.append(f'{dep.name} = ["{dep.name if gtp else dep.url}", "v1.*"]')
+    return '\n'.join(lines) + '\n'
+
+
+def files(pkg: SyntheticPackage, graph: Graph, *, file_count: int = 5, file_size: int = 2048) -> dict[str, str]:
+    ret = {"inflator.toml": manifest([graph.packages[dep] for dep in pkg.deps], name=pkg.name)}
+
+    line = f"costumes \"{pkg.name}.svg\"; # " + "x" * 60 + "\n"
+    for i in range(file_count):
+        ret[f"src/{pkg.name}_{i}.gs"] = line * max(1, file_size // len(line))
+
+    return ret
+
+
+def publish(graph: Graph, github: FakeGitHub, *, file_count: int = 5, file_size: int = 2048):
+    """
+    Add every version of every package to a fake GitHub, and register each package in its gtp
+    """
+    for pkg in graph.packages.values():
+        content = files(pkg, graph, file_count=file_count, file_size=file_size)
+        for tag in pkg.tags:
+            github.add(OWNER, pkg.name, tag, content)
+        github.gtp[pkg.name] = {"url": pkg.url}
@@ -0,0 +1,91 @@
+"""
+Upgrade benchmark: installing a new tag of an installed package by delta (only the files that changed) against
+downloading the whole zipball, fully offline.
+
+The package has many .gs files and a big asset folder, and the new tag changes a few .gs files. Both ways should
+install exactly the same files.
+
+    python benchmarks/upgrade.py --files 200 --changed 3 --assets 20
+"""
+from __future__ import annotations
+
+import argparse
+import filecmp
+import json
+import pathlib
+import random
+import sys
+import tempfile
+
+import run
+from fakegh import FakeGitHub
+
+sys.path.insert(0, str(run.ROOT))
+
+from inflator.util import SOURCE_FILE  # noqa: E402
+
+REPO = "https://github.com/bench/big"
+
+
+def same_tree(a: pathlib.Path, b: pathlib.Path) -> bool:
+    # each install's record of where it came from differs, since only the full one has a zipball hash
+    cmp = filecmp.dircmp(a, b, ignore=filecmp.DEFAULT_IGNORES + [SOURCE_FILE])
+    if cmp.left_only or cmp.right_only or cmp.funny_files:
+        return False
+    if filecmp.cmpfiles(a, b, cmp.common_files, shallow=False)[1:] != ([], []):
+        return False
+    return all(same_tree(a / sub, b / sub) for sub in cmp.common_dirs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, default=200, help=".gs files in the package")
+    parser.add_argument("--changed", type=int, default=3, help=".gs files changed by the new tag")
+    parser.add_argument("--assets", type=int, default=20, help="MiB of (incompressible) assets")
+    parser.add_argument("--json", metavar="FILE", help="Also write the results to FILE")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    old = {"inflator.toml": 'name = "big"\n', "assets/sprites.bin": rng.randbytes(args.assets * 1024 ** 2)}
+    old |= {f"src/{i % 20}/file{i}.gs": f"proc file{i} {{ say {i}; }}\n" * 20 for i in range(args.files)}
+    new = dict(old)
+    for i in rng.sample(range(args.files), args.changed):
+        new[f"src/{i % 20}/file{i}.gs"] += "# changed\n"
+    new["src/added.gs"] = "proc added {}\n"
+    del new["src/0/file0.gs"]
+
+    github = FakeGitHub()
+    github.add("bench", "big", "v1.1.0", new)
+    github.add("bench", "big", "v1.0.0", old)
+    api = github.start()
+    zipball_size = len(github.zipball("bench", "big", "v1.1.0"))
+
+    results = {}
+    trees = {}
+    for mode, cookies in (("full", {"delta-max-files": "0"}), ("delta", {})):
+        bench = run.Bench(pathlib.Path(tempfile.mkdtemp(prefix=f"inflate-upgrade-{mode}-")), api)
+        for key, value in cookies.items():
+            bench.inflate("set", key, value)
+
+        bench.inflate("install", REPO, "-V", "v1.0.0")
+        before = github.requests.copy()
+        elapsed = bench.inflate("install", REPO, "-V", "v1.1.0")
+
+        requests = dict(github.requests - before)
+        results[mode] = {"ms": round(elapsed * 1000, 1), "requests": requests}
+        trees[mode] = bench.inflate_dir / "pkgs" / "bench" / "big" / "v1.1.0"
+
+    github.stop()
+
+    print(f"zipball of v1.1.0: {zipball_size} bytes, {args.changed} of {args.files} .gs files changed")
+    for mode, result in results.items():
+        print(f"{mode:>6}: {result['ms']:>8} ms  {result['requests']}")
+    print("Installed trees match" if same_tree(trees["full"], trees["delta"]) else "Installed trees DIFFER")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -2,22 +2,20 @@ from __future__ import annotations
 
 import argparse
 import pathlib
-import pprint
-import time
-import tomllib
+import sys
 import logging
+import logging.handlers
 
 from datetime import datetime
 
 from inflator import __version__
-from inflator.install import install
-from inflator.new import new as inflator_new
-from inflator.parse import parse_gstoml, parse_iftoml
-from inflator.package import search_for_package
-from inflator.sync import sync
-from inflator.util import ERROR_MSG, AURA
-from inflator.toml import toml as inflator_toml
-from inflator.cookies import cookies
+
+# Subcommands import what they need when they run, so that e.g. `inflate -V` doesn't pay for httpx, furl or slugify.
+# Check with benchmarks/startup.py
+
+# inflate.log is rotated once it gets this big, keeping this many old logs
+LOG_MAX_BYTES = 1024 ** 2
+LOG_BACKUPS = 3
 
 
 def main():
@@ -26,9 +24,12 @@ def main():
 
     log_folder.mkdir(exist_ok=True)
 
-    logging.basicConfig(filename=log_folder / f"{time.time()}.log", level=logging.INFO)
+    handler = logging.handlers.RotatingFileHandler(log_folder / "inflate.log", maxBytes=LOG_MAX_BYTES,
+                                                   backupCount=LOG_BACKUPS, encoding="utf-8")
+    logging.basicConfig(handlers=[handler], level=logging.INFO,
+                        format="%(asctime)s %(levelname)s %(threadName)s: %(message)s")
 
-    logging.info(f"init: {datetime.now()}")
+    logging.info("init: %s", datetime.now())
 
     parser = argparse.ArgumentParser(
         prog="inflate",
@@ -40,6 +41,11 @@ def main():
     parser.add_argument("-i", "--input", action="store", help="Set input directory for syncing. Default is cwd")
     parser.add_argument("-V", "--version", action="store_true", dest="V", help="Get inflator version number")
     parser.add_argument("-L", "--log-folder", action="store_true", dest="L", help="Get log folder")
+    parser.add_argument("--profile", action="store_true",
+                        help="Time each phase (manifest parsing, gtp, tags, download, extraction, copying, symlinking) "
+                             "and package, and print a summary at the end")
+    parser.add_argument("--trace", action="store", metavar="FILE",
+                        help="Like --profile, but also write a Chrome trace (chrome://tracing, ui.perfetto.dev) to FILE")
 
     install_parser = subparsers.add_parser("install", help="Install a package")
     install_parser.add_argument("parg", nargs="?", help="Package to install")
@@ -52,7 +58,20 @@ def main():
                                 help="Whether to force overwrite packages "
                                      "instead of just installing ones that dont exist")
     install_parser.add_argument("-r", "--requirements", nargs="?", dest="install_requirements",
-                                help="Path to inflator.toml/goboscript.toml file")
+                                help="Path to inflator.toml/goboscript.toml file. If there is an up to date "
+                                     "inflator.lock next to it, that is installed instead without resolving anything. "
+                                     "Otherwise, inflator.lock is (re)written")
+    install_parser.add_argument("--frozen", action="store_true", dest="install_frozen",
+                                help="With -r, fail instead of resolving if inflator.lock is missing or out of date")
+    install_parser.add_argument("-j", "--jobs", type=int, default=8, dest="install_jobs",
+                                help="Number of packages to fetch/install at the same time. Default is 8")
+    install_parser.add_argument("--refresh", action="store_true", dest="install_refresh",
+                                help="Re-fetch the gtp registry and tag lists instead of using cached copies")
+    install_parser.add_argument("--offline", action="store_true", dest="install_offline",
+                                help="Never use the network. Versions are matched against installed and cached ones, "
+                                     "gtp names against the cached registry, and archives come from the download "
+                                     "cache. Fails with a list of anything missing. "
+                                     "Turn on permanently with `inflate set offline true`")
 
     find_parser = subparsers.add_parser("find", help="Locate a package with a name/version/creator. "
                                                      "Can also be used to list out installed pkgs. "
@@ -62,6 +81,9 @@ def main():
                              help="Version of package")
     find_parser.add_argument("-U", "--username", nargs="?", dest="find_username",
                              help="Username of creator of package")
+    find_parser.add_argument("--reindex", action="store_true", dest="find_reindex",
+                             help="Rebuild the index of installed packages first. "
+                                  "Only needed if the package folder was edited by hand")
 
     parse_parser = subparsers.add_parser("parse", help="Parse gstoml or iftoml file")
     parse_parser.add_argument("name", nargs="?", help="Path to goboscript.toml or inflator.toml")  # , dest="find_name")
@@ -71,6 +93,27 @@ def main():
     new_parser = subparsers.add_parser("new", help="Create an (inflated) goboscript project")
     new_parser.add_argument("name", nargs="?", help="Name of package/repository")
 
+    store_parser = subparsers.add_parser("store", help="Manage the store that installed gh packages share files from")
+    store_parser.add_argument("store_action", choices=("stats", "gc", "migrate"),
+                              help="stats: show how much space deduplication saves. "
+                                   "gc: delete files no installed package uses. "
+                                   "migrate: deduplicate packages installed before the store existed")
+
+    graph_parser = subparsers.add_parser("graph", help="Show the dependency graph of a project, in install order")
+    graph_parser.add_argument("path", nargs="?", help="Project directory. Default is the -i directory, or cwd")
+    graph_parser.add_argument("-f", "--format", choices=("text", "dot", "json"), default="text", dest="graph_format",
+                              help="text lists the packages in waves that only depend on earlier ones, "
+                                   "dot is for graphviz")
+
+    serve_parser = subparsers.add_parser("serve", help="Run a caching proxy of the GitHub API for other machines to "
+                                                        "install through. Use it with `inflate set github-api <url>`")
+    serve_parser.add_argument("--host", default="127.0.0.1", dest="serve_host",
+                              help="Address to listen on. Use 0.0.0.0 to serve the LAN. Default is 127.0.0.1")
+    serve_parser.add_argument("-p", "--port", type=int, default=8765, dest="serve_port",
+                              help="Port to listen on. Default is 8765")
+    serve_parser.add_argument("--upstream", dest="serve_upstream",
+                              help="API to fetch from. Default is the serve-upstream cookie, or api.github.com")
+
     set_parser = subparsers.add_parser("set", help="Set config in cookies.json")
     set_parser.add_argument("key", help="Key of cookie")
     set_parser.add_argument("value", nargs='?', help="Value of cookie. Set empty to delete")
@@ -78,28 +121,74 @@ def main():
     # args, _ = parser.parse_known_args()
     args = parser.parse_args()
 
+    if args.profile or args.trace:
+        from inflator.profile import profiler
+        profiler.enable()
+
     match args.command:
         case "install":
+            import tomllib
+
+            from inflator import gtp, lock, net, tags
+            from inflator.install import install
+            from inflator.package import install_packages
+            from inflator.parse import parse_gstoml, parse_iftoml
+            from inflator.util import ERROR_MSG
+
+            if args.install_refresh:
+                gtp.force_refresh = tags.force_refresh = True
+            if args.install_offline:
+                net.offline = True
+
             if args.install_requirements:
-                with open(args.install_requirements, "rb") as f:
-                    if f.name.endswith("goboscript.toml"):
-                        deps = parse_gstoml(tomllib.load(f)).deps
-                    elif f.name.endswith("inflator.toml"):
-                        deps = parse_iftoml(tomllib.load(f)).deps
+                manifest = pathlib.Path(args.install_requirements)
+                if not manifest.name.endswith(("goboscript.toml", "inflator.toml")):
+                    raise ValueError(f"File {manifest.name!r} is not goboscript.toml or inflator.toml\n{ERROR_MSG}")
+
+                with open(manifest, "rb") as f:
+                    toml = tomllib.load(f)
+
+                locked = lock.read(manifest.parent)
+                fresh = locked is not None and lock.is_fresh(locked, manifest.parent, [manifest.name])
+
+                if args.install_frozen and not fresh:
+                    raise ValueError(f"{lock.LOCK_NAME} is missing or does not match {manifest}. "
+                                     f"Run without --frozen to update it")
+
+                if fresh and (args.install_frozen or not args.install_upgrade):
+                    print(f"Installing from {lock.LOCK_NAME}")
+                    install_packages(lock.packages(locked), upgrade=args.install_upgrade, jobs=args.install_jobs,
+                                     recursive=False)
+                else:
+                    if manifest.name.endswith("goboscript.toml"):
+                        deps = parse_gstoml(toml).deps
                     else:
-                        raise ValueError(f"File {f.name!r} is not goboscript.toml or inflator.toml\n{ERROR_MSG}")
+                        deps = parse_iftoml(toml).deps
 
-                for dep in deps:
-                    dep.install(editable=args.install_editable, upgrade=args.install_upgrade)
+                    nodes = install_packages(deps, editable=args.install_editable, upgrade=args.install_upgrade,
+                                             jobs=args.install_jobs)
+                    lock.write(manifest, toml, deps, nodes)
             else:
-                install(args.parg, args.install_version, upgrade=args.install_upgrade, editable=args.install_editable)
+                install(args.parg, args.install_version, upgrade=args.install_upgrade, editable=args.install_editable,
+                        jobs=args.install_jobs)
 
         case "find":
+            from inflator import index
+            from inflator.package import search_for_package
+
+            if args.find_reindex:
+                index.rebuild()
+
             pks = search_for_package(args.find_username, args.name, args.find_version)
             for pk in pks:
                 print(pk.name)
 
         case "parse":
+            import pprint
+            import tomllib
+
+            from inflator.parse import parse_gstoml, parse_iftoml
+
             with open(args.name, "rb") as f:
                 if f.name.endswith("goboscript.toml"):
                     data = parse_gstoml(tomllib.load(f))
@@ -108,11 +197,56 @@ def main():
                 pprint.pp(data)
 
         case "toml":
+            from inflator.toml import toml as inflator_toml
+
             inflator_toml()
 
         case "new":
+            from inflator.new import new as inflator_new
+
             inflator_new(args.name)
+        case "store":
+            from inflator import store
+
+            match args.store_action:
+                case "stats":
+                    stats = store.stats()
+                    print(f"Blobs: {stats.blobs} ({stats.blob_bytes} bytes), {stats.references} references, "
+                          f"{stats.unused_blobs} unused")
+                    print(f"Installed files: {stats.files} ({stats.logical_bytes} bytes)")
+                    print(f"On disk: {stats.physical_bytes} bytes, dedup ratio {stats.dedup_ratio:.2f}x")
+                case "gc":
+                    count, size = store.gc()
+                    print(f"Freed {count} blobs ({size} bytes)")
+                case "migrate":
+                    stats = store.migrate()
+                    print(f"Migrated {stats['packages']} packages: {stats['stored']} files stored, "
+                          f"{stats['deduplicated']} deduplicated, {stats['skipped']} skipped")
+                    count, size = store.gc()
+                    print(f"Freed {count} blobs ({size} bytes)")
+
+        case "graph":
+            import json
+
+            from inflator.sync import dependency_graph
+
+            dependencies = dependency_graph(pathlib.Path(args.path or args.input or pathlib.Path.cwd()))
+            match args.graph_format:
+                case "text":
+                    print(dependencies.to_text())
+                case "dot":
+                    print(dependencies.to_dot())
+                case "json":
+                    print(json.dumps(dependencies.to_json(), indent=2))
+
+        case "serve":
+            from inflator.serve import serve
+
+            serve(args.serve_host, args.serve_port, args.serve_upstream)
+
         case "set":
+            from inflator.cookies import cookies
+
             if args.value is None:
                 print(f"Deleting {args.key!r}")
                 del cookies[args.key]
@@ -132,7 +266,20 @@ def main():
                 else:
                     cwd = pathlib.Path.cwd()
 
+                from inflator.sync import sync
+
                 sync(cwd)
 
         case _:
             print(f"Unknown command: {args.command!r}")
+
+    if package := sys.modules.get("inflator.package"):
+        logging.info("Resolution memo: %d hits, %d misses", package.memo_stats["hits"], package.memo_stats["misses"])
+
+    if args.profile or args.trace:
+        print(profiler.summary())
+        if package:
+            print(f"resolution memo: {package.memo_stats['hits']} hits, {package.memo_stats['misses']} misses")
+        if args.trace:
+            profiler.write_trace(pathlib.Path(args.trace))
+            print(f"Wrote trace to {args.trace}")
@@ -0,0 +1,149 @@
+# Reading GitHub zipballs
+from __future__ import annotations
+
+import logging
+import os
+import pathlib
+import shutil
+import tomllib
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Optional
+from zipfile import ZipFile, ZipInfo
+
+from inflator.cookies import cookies
+from inflator.fileops import DEFAULT_IGNORE, matches
+from inflator.util import CHUNK_SIZE
+
+# What is extracted from a zipball, unless its inflator.toml has an `include = [...]` list.
+# goboscript only reads .gs files and the manifests, so docs, images, CI configs, example projects etc are left out.
+# Use `include = ["*"]` to keep everything. Same pattern syntax as fileops.DEFAULT_IGNORE
+DEFAULT_INCLUDE = ("*.gs", "LICENSE*", "COPYING*")
+# Always extracted, since dependencies are read from them
+MANIFESTS = ("/inflator.toml", "/goboscript.toml")
+
+# Uncompressed bytes per extraction thread. Smaller archives use fewer threads
+PARALLEL_MIN_BYTES = 1024 ** 2
+
+
+def top_level(archive_path: pathlib.Path) -> str:
+    """
+    Name of the folder GitHub wraps a zipball in: '{owner}-{repo}-{short commit sha}'
+    """
+    with ZipFile(archive_path) as archive:
+        return archive.infolist()[0].filename.split('/')[0]
+
+
+def read_manifest(archive: ZipFile, prefix: str) -> Optional[dict]:
+    """
+    The inflator.toml at the root of a zipball, if it has one
+    """
+    try:
+        return tomllib.loads(archive.read(f"{prefix}/inflator.toml").decode())
+    except KeyError:
+        return None
+
+
+def selection(manifest: Optional[dict], include: Optional[Iterable[str]] = None,
+              exclude: Iterable[str] = ()) -> tuple[tuple[str, ...], tuple[str, ...]]:
+    """
+    The include and exclude patterns for a package with this inflator.toml. See extract_zipball
+    """
+    manifest = manifest or {}
+    if include is None:
+        include = manifest.get("include", DEFAULT_INCLUDE)
+    return (*MANIFESTS, *include), (*DEFAULT_IGNORE, *manifest.get("exclude", []), *exclude)
+
+
+def clean_path(relpath: str) -> Optional[str]:
+    """
+    Same sanitisation as ZipFile.extract: no absolute paths or escaping the destination. None if nothing is left
+    """
+    return '/'.join(p for p in relpath.split('/') if p not in ('', '.', '..')) or None
+
+
+def wanted(relpath: str, include: Iterable[str], exclude: Iterable[str]) -> bool:
+    return matches(relpath, include) and not matches(relpath, exclude)
+
+
+def extract_zipball(archive_path: pathlib.Path, dest: pathlib.Path, include: Optional[Iterable[str]] = None,
+                    exclude: Iterable[str] = (), jobs: Optional[int] = None) -> str:
+    """
+    Extract a GitHub zipball straight into dest, stripping the 'owner-repo-sha/' folder that GitHub wraps everything in.
+    Only members matching include and not exclude are extracted. They are streamed out of the archive in CHUNK_SIZE
+    blocks, which also checks the CRC of each one.
+    Big archives are extracted by several threads at once (zlib releases the GIL), each with its own handle on the
+    archive.
+    :param include: patterns of files to extract, on top of MANIFESTS. Defaults to the `include` list of the zipball's
+    inflator.toml, or DEFAULT_INCLUDE
+    :param exclude: patterns of files to leave out, on top of the `exclude` list of the inflator.toml and
+    fileops.DEFAULT_IGNORE
+    :param jobs: maximum number of threads. Defaults to the extract-jobs cookie, or the number of CPUs (up to 8)
+    :return: the name of the top-level folder that was stripped
+    """
+    with ZipFile(archive_path) as archive:
+        members = archive.infolist()
+        assert members, f"Empty zipball {archive_path}"
+
+        prefix = members[0].filename.split('/')[0]
+        manifest = read_manifest(archive, prefix) or {}
+
+    include, exclude = selection(manifest, include, exclude)
+
+    logging.info("Extracting %d members of %s into %s, stripping %r. include=%s, exclude=%s",
+                 len(members), archive_path, dest, prefix, include, exclude)
+
+    # by target, so that each file is only written once even if the archive has duplicate names
+    targets: dict[pathlib.Path, ZipInfo] = {}
+    for info in members:
+        top, _, relpath = info.filename.partition('/')
+        assert top == prefix, f"Zipball has multiple top-level folders: {prefix!r}, {top!r}"
+
+        relpath = clean_path(relpath)
+        if relpath is None or info.is_dir():
+            # folders are made as needed for the files that are kept
+            continue
+
+        if not wanted(relpath, include, exclude):
+            continue
+
+        targets[dest.joinpath(*relpath.split('/'))] = info
+
+    todo = [(info, target) for target, info in targets.items()]
+
+    # Make every folder up front, so the workers only ever create files
+    dest.mkdir(parents=True, exist_ok=True)
+    for folder in sorted({target.parent for _, target in todo}):
+        folder.mkdir(parents=True, exist_ok=True)
+
+    if jobs is None:
+        jobs = int(cookies.get("extract-jobs", min(8, os.cpu_count() or 1)))
+    # Not worth the threads for small archives
+    jobs = max(1, min(jobs, len(todo), sum(info.file_size for info, _ in todo) // PARALLEL_MIN_BYTES))
+
+    if jobs == 1:
+        _extract_members(archive_path, todo)
+    else:
+        # Give each thread a share of about the same size, biggest files first
+        shares: list[list[tuple[ZipInfo, pathlib.Path]]] = [[] for _ in range(jobs)]
+        sizes = [0] * jobs
+        for info, target in sorted(todo, key=lambda item: item[0].file_size, reverse=True):
+            i = sizes.index(min(sizes))
+            shares[i].append((info, target))
+            sizes[i] += info.file_size
+
+        with ThreadPoolExecutor(max_workers=jobs, thread_name_prefix="extract") as pool:
+            for future in [pool.submit(_extract_members, archive_path, share) for share in shares]:
+                future.result()
+
+    logging.info("Extracted %d files with %d thread(s)", len(todo), jobs)
+    return prefix
+
+
+def _extract_members(archive_path: pathlib.Path, todo: list[tuple[ZipInfo, pathlib.Path]]):
+    # ZipFile handles can't be shared between threads, so each share of the work opens its own
+    with ZipFile(archive_path) as archive:
+        for info, target in todo:
+            # Reading a member to the end makes zipfile check its CRC, raising BadZipFile if it doesn't match
+            with archive.open(info) as src, open(target, "wb") as dst:
+                shutil.copyfileobj(src, dst, CHUNK_SIZE)
@@ -1,35 +1,88 @@
 # store 'cookies' in appdata
-import json
+import os
+import threading
 
-from typing import Any
+from contextlib import contextmanager
+from typing import Any, Iterator
 
-import github
+from inflator.util import APPDATA_FARETEK_COOKIES, read_json, write_json, file_lock
 
-from inflator.util import APPDATA_FARETEK_COOKIES
+CookieValue = str | int | None | bool | float | list | dict[str, Any]
 
 
 class _Cookies:
+    """
+    cookies.json, cached in memory. The file is only re-read when its mtime or size changes, and writes are atomic and
+    done under a file lock, so that concurrent inflate processes can't corrupt it
+    """
     def __init__(self):
         (APPDATA_FARETEK_COOKIES / '..').resolve().mkdir(parents=True, exist_ok=True)
         if not APPDATA_FARETEK_COOKIES.exists():
-            APPDATA_FARETEK_COOKIES.write_text("{}")
+            with self._file_lock():
+                if not APPDATA_FARETEK_COOKIES.exists():
+                    write_json(APPDATA_FARETEK_COOKIES, {}, fsync=True)
+
+        self._lock = threading.RLock()
+        self._cache: dict[str, CookieValue] = {}
+        self._signature = None
+
+    @staticmethod
+    def _file_lock():
+        return file_lock(APPDATA_FARETEK_COOKIES.with_name(f"{APPDATA_FARETEK_COOKIES.name}.lock"))
+
+    @staticmethod
+    def _stat_signature():
+        try:
+            st = os.stat(APPDATA_FARETEK_COOKIES)
+        except FileNotFoundError:
+            return None
+        return st.st_mtime_ns, st.st_size
 
     @property
-    def data(self) -> dict[str, str | int | None | bool | float | list | dict[str, Any]]:
-        return json.load(APPDATA_FARETEK_COOKIES.open())
+    def data(self) -> dict[str, CookieValue]:
+        with self._lock:
+            signature = self._stat_signature()
+            if signature != self._signature:
+                self._cache = read_json(APPDATA_FARETEK_COOKIES, {})
+                self._signature = signature
+
+            return dict(self._cache)
 
     @data.setter
-    def data(self, data: dict[str, str | int | None | bool | float | list | dict[str, Any]]):
-        json.dump(data, APPDATA_FARETEK_COOKIES.open("w"))
+    def data(self, data: dict[str, CookieValue]):
+        with self._lock, self._file_lock():
+            self._write(data)
 
-    def __setitem__(self, key: str, value: str | int | None | bool | float | list | dict[str, Any]):
-        self.data |= {key: value}
+    def _write(self, data: dict[str, CookieValue]):
+        # Must be called with both locks held
+        write_json(APPDATA_FARETEK_COOKIES, data, fsync=True)
+        self._cache = dict(data)
+        self._signature = self._stat_signature()
+
+    @contextmanager
+    def batch(self) -> Iterator[dict[str, CookieValue]]:
+        """
+        Edit several cookies with a single write. The yielded dict is written back when the block exits without error,
+        and other processes are locked out until then
+        """
+        with self._lock, self._file_lock():
+            data = self.data
+            yield data
+            self._write(data)
+
+    def update(self, __m: dict[str, CookieValue] = None, **kwargs: CookieValue):
+        with self.batch() as data:
+            data.update(__m or {}, **kwargs)
+
+    def __setitem__(self, key: str, value: CookieValue):
+        self.update({key: value})
 
     def __getitem__(self, key):
         return self.data[key]
 
     def __delitem__(self, key: str):
-        self.data = {k: v for k, v in self.data.items() if k != key}
+        with self.batch() as data:
+            data.pop(key, None)
 
     def __contains__(self, item):
         return item in self.data
@@ -39,5 +92,3 @@ class _Cookies:
 
 
 cookies = _Cookies()
-
-gh = github.Github(cookies.get("auth-token"))
@@ -0,0 +1,211 @@
+# Delta upgrades: build a new version of a gh package out of an installed version of the same repo, downloading only
+# the files that changed between the two instead of the whole zipball
+from __future__ import annotations
+
+import hashlib
+import logging
+import os
+import pathlib
+import shutil
+import tomllib
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Optional
+
+from inflator import archive, index, net, package, tags, version
+from inflator.cookies import cookies
+from inflator.net import api_base, api_headers
+from inflator.util import SOURCE_FILE, rmtree
+
+# Upgrades that change more extracted files than this download the whole zipball instead.
+# Configure with `inflate set delta-max-files <n>`. 0 disables delta upgrades
+DEFAULT_MAX_FILES = 100
+# The compare API lists at most this many files, so a diff this big may be incomplete
+COMPARE_MAX_FILES = 300
+# Blobs downloaded at once. Configure with `inflate set delta-jobs <n>`
+DEFAULT_JOBS = 8
+
+
+class _Fallback(Exception):
+    # Why a delta upgrade can't be done, so the whole zipball is needed
+    pass
+
+
+def max_files() -> int:
+    return int(cookies.get("delta-max-files", DEFAULT_MAX_FILES))
+
+
+def blob_sha(data: bytes) -> str:
+    """
+    Git's object id of a file with this content, as listed by the compare API
+    """
+    return hashlib.sha1(b"blob %d\0" % len(data) + data).hexdigest()
+
+
+def base_for(pkg: package.Package) -> Optional[package.Package]:
+    """
+    An installed version of the same repo to build pkg from: the newest one older than pkg.version. Newer ones are no
+    use, since the compare API only lists the files of a tag that is ahead of the base.
+    Only versions installed from GitHub (so with a known commit) can be used
+    """
+    target = version.sort_key(pkg.version)
+    older = [other for other in package.search_for_package(pkg.username, pkg.reponame, globbed=False)
+             if other.commit and version.sort_key(other.version) < target and other.local_path.is_dir()]
+    return max(older, key=lambda other: version.sort_key(other.version), default=None)
+
+
+def install(pkg: package.Package, info: dict[str, Any]) -> Optional[str]:
+    """
+    Install a gh package with a resolved version by copying an installed version of the same repo (as hardlinks where
+    possible) and downloading only the files that differ, checking each against its git object id
+    :param info: profiler phase info to fill in
+    :return: the commit that was installed, or None if this couldn't be done and nothing was changed, so the zipball
+    should be downloaded instead
+    """
+    limit = max_files()
+    if not limit:
+        return None
+
+    base = base_for(pkg)
+    if base is None:
+        return None
+
+    info["base"] = base.version
+    tmp = pkg.install_path.with_name(f".{pkg.install_path.name}.inflator-delta")
+    try:
+        commit = _build(pkg, base, tmp, limit, info)
+    except _Fallback as e:
+        logging.info("Not upgrading %s from %s by delta: %s", pkg.name, base.version, e)
+        rmtree(tmp, ignore_errors=True)
+        return None
+    except BaseException:
+        rmtree(tmp, ignore_errors=True)
+        raise
+
+    index.remove(str(pkg.username), pkg.reponame, pkg.version)
+    if pkg.install_path.is_symlink():
+        pkg.install_path.unlink()
+    else:
+        rmtree(pkg.install_path, ignore_errors=True)
+    os.replace(tmp, pkg.install_path)
+
+    logging.info("Upgraded %s from %s by delta: %s", pkg.name, base.version, info)
+    return commit
+
+
+def _get(url: str, **kwargs):
+    import httpx
+
+    try:
+        resp = net.request("GET", url, **kwargs)
+        resp.raise_for_status()
+    except httpx.HTTPError as e:
+        raise _Fallback(f"{url}: {e}") from e
+    return resp
+
+
+def _head_commit(pkg: package.Package, base: package.Package, data: dict[str, Any]) -> str:
+    if data["status"] == "identical":
+        return base.commit
+
+    # the tag list already says which commit each tag is
+    if entry := tags.cached(pkg.username, pkg.reponame):
+        for tag in entry["tags"]:
+            if tag["name"] == pkg.version and tag.get("sha"):
+                return tag["sha"]
+
+    commits = data.get("commits", [])
+    if not commits or data.get("total_commits", len(commits)) != len(commits):
+        raise _Fallback("can't tell which commit the tag is")
+    return commits[-1]["sha"]
+
+
+def _build(pkg: package.Package, base: package.Package, tmp: pathlib.Path, limit: int,
+           info: dict[str, Any]) -> str:
+    # Assemble the new version in tmp. Returns its commit
+    repo_url = f"{api_base()}/repos/{pkg.username}/{pkg.reponame}"
+    data = _get(f"{repo_url}/compare/{base.commit}...{pkg.version}", headers=api_headers()).json()
+
+    if data.get("status") not in ("ahead", "identical"):
+        # for diverged tags, the files are relative to a merge base rather than to base
+        raise _Fallback(f"{pkg.version} is {data.get('status')} of {base.version}")
+
+    commit = _head_commit(pkg, base, data)
+    if pkg.commit and not (commit.startswith(pkg.commit) or pkg.commit.startswith(commit)):
+        # let the full install report it
+        raise _Fallback(f"tag is at {commit}, not the locked {pkg.commit}")
+
+    files = data.get("files", [])
+    if len(files) >= COMPARE_MAX_FILES:
+        raise _Fallback(f"{len(files)} files changed")
+
+    def fetch(sha: str) -> bytes:
+        content = _get(f"{repo_url}/git/blobs/{sha}",
+                       headers={**api_headers(), "Accept": "application/vnd.github.raw+json"}).content
+        if blob_sha(content) != sha:
+            raise _Fallback(f"blob {sha} doesn't match its content")
+        return content
+
+    # path -> blob sha of everything that is different in the new version
+    changed: dict[str, Optional[str]] = {}
+    for file in files:
+        if file["status"] == "renamed":
+            changed[file["previous_filename"]] = None
+        changed[file["filename"]] = None if file["status"] == "removed" else file["sha"]
+
+    # The new inflator.toml decides what is extracted, so it has to be the same as before
+    manifest_path = base.local_path / "inflator.toml"
+    old_manifest = tomllib.loads(manifest_path.read_text()) if manifest_path.exists() else None
+    content: dict[str, bytes] = {}
+    new_manifest = old_manifest
+    if "inflator.toml" in changed:
+        sha = changed["inflator.toml"]
+        if sha is None:
+            new_manifest = None
+        else:
+            content["inflator.toml"] = fetch(sha)
+            new_manifest = tomllib.loads(content["inflator.toml"].decode())
+
+    include, exclude = archive.selection(new_manifest)
+    if archive.selection(old_manifest) != (include, exclude):
+        raise _Fallback("include/exclude changed")
+
+    todo = {}
+    for path, sha in changed.items():
+        relpath = archive.clean_path(path)
+        if sha is not None and relpath is not None and archive.wanted(relpath, include, exclude):
+            todo[relpath] = sha
+
+    if len(todo) > limit:
+        raise _Fallback(f"{len(todo)} files to download, more than delta-max-files={limit}")
+
+    # Everything that didn't change comes from base
+    rmtree(tmp, ignore_errors=True)
+    linked = 0
+    for root, dirs, names in base.local_path.walk():
+        rel_root = root.relative_to(base.local_path)
+        for name in names:
+            relpath = (rel_root / name).as_posix()
+            if relpath in changed or relpath == SOURCE_FILE:
+                continue
+
+            target = tmp / rel_root / name
+            target.parent.mkdir(parents=True, exist_ok=True)
+            try:
+                os.link(root / name, target)
+            except OSError:
+                shutil.copy2(root / name, target)
+            linked += 1
+
+    with ThreadPoolExecutor(max_workers=int(cookies.get("delta-jobs", DEFAULT_JOBS)),
+                            thread_name_prefix="delta") as pool:
+        missing = [relpath for relpath in todo if relpath not in content]
+        content.update(zip(missing, pool.map(fetch, [todo[relpath] for relpath in missing])))
+
+    for relpath in todo:
+        target = tmp / relpath
+        target.parent.mkdir(parents=True, exist_ok=True)
+        target.write_bytes(content[relpath])
+
+    info.update(linked=linked, downloaded=len(todo), bytes=sum(len(content[relpath]) for relpath in todo))
+    return commit
@@ -0,0 +1,230 @@
+# Incremental copying of package trees, cloning or hardlinking files where the filesystem allows it
+from __future__ import annotations
+
+import errno
+import fnmatch
+import functools
+import logging
+import os
+import pathlib
+import re
+import shutil
+import sys
+import threading
+
+from collections import Counter
+from typing import Iterable, Optional
+
+from inflator.cookies import cookies
+from inflator.util import file_hash, rmtree
+
+# Never installed from a local package. Patterns are matched against each file/folder name, or against the whole
+# path relative to the package if they contain a '/'. A trailing '/' only matches folders.
+# Packages can add their own with an `exclude = [...]` list in inflator.toml
+DEFAULT_IGNORE = (".git/", ".hg/", ".svn/", ".idea/", ".vscode/", "__pycache__/", "build/", "dist/",
+                  "*.pyc", ".DS_Store", "Thumbs.db")
+
+# How files are put into the package store. Configure with `inflate set link-mode <mode>`
+# auto: reflink, falling back to hardlink, then copy. Note that a hardlink *is* the source file, so edits to a local
+# package show up in the installation straight away (until the editor replaces the file instead of writing to it)
+LINK_MODES = ("auto", "reflink", "hardlink", "copy")
+DEFAULT_LINK_MODE = "auto"
+
+# linux/fs.h
+_FICLONE = 0x40049409
+
+_lock = threading.Lock()
+# (method, source device, destination device) pairs that have already failed, so they aren't retried for every file
+_unsupported: set[tuple[str, int, int]] = set()
+
+
+def link_mode() -> str:
+    mode = str(cookies.get("link-mode", DEFAULT_LINK_MODE))
+    if mode not in LINK_MODES:
+        logging.warning("Unknown link-mode %r, using %r. Choose from %s", mode, DEFAULT_LINK_MODE, LINK_MODES)
+        return DEFAULT_LINK_MODE
+    return mode
+
+
+@functools.lru_cache(maxsize=64)
+def _compile(patterns: tuple[str, ...]) -> tuple[re.Pattern, re.Pattern, re.Pattern, re.Pattern]:
+    # regexes matching (file names, file paths, folder names, folder paths)
+    groups = [], [], [], []
+    for pattern in patterns:
+        dir_only = pattern.endswith('/')
+        pattern = pattern.rstrip('/')
+        by_path = '/' in pattern
+        regex = fnmatch.translate(pattern.lstrip('/'))
+
+        if not dir_only:
+            groups[by_path].append(regex)
+        groups[2 + by_path].append(regex)
+
+    # like fnmatch, case-insensitive on windows
+    flags = re.IGNORECASE if sys.platform == "win32" else 0
+    return tuple(re.compile('|'.join(group) or r"(?!)", flags) for group in groups)
+
+
+def is_ignored(relpath: pathlib.PurePath | str, is_dir: bool, patterns: Iterable[str]) -> bool:
+    """
+    Whether a file or folder matches any of the patterns. See DEFAULT_IGNORE for the syntax
+    """
+    path = relpath if isinstance(relpath, str) else relpath.as_posix()
+    name_re, path_re = _compile(tuple(patterns))[2 * is_dir:2 * is_dir + 2]
+    return bool(name_re.match(path.rsplit('/', 1)[-1]) or path_re.match(path))
+
+
+def matches(relpath: pathlib.PurePath | str, patterns: Iterable[str]) -> bool:
+    """
+    Whether a file, or any folder it is in, matches any of the patterns
+    """
+    path = relpath if isinstance(relpath, str) else relpath.as_posix()
+    file_name_re, file_path_re, dir_name_re, dir_path_re = _compile(tuple(patterns))
+
+    parts = path.split('/')
+    if file_name_re.match(parts[-1]) or file_path_re.match(path):
+        return True
+    return any(dir_name_re.match(parts[i - 1]) or dir_path_re.match('/'.join(parts[:i]))
+               for i in range(1, len(parts)))
+
+
+def _reflink(src: pathlib.Path, dst: pathlib.Path):
+    if sys.platform != "linux":
+        raise OSError(errno.EOPNOTSUPP, "reflinks are only implemented on linux")
+
+    import fcntl
+
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), _FICLONE, fsrc.fileno())
+        except OSError:
+            fdst.close()
+            dst.unlink(missing_ok=True)
+            raise
+    shutil.copystat(src, dst)
+
+
+def _place(src: pathlib.Path, dst: pathlib.Path, mode: str) -> str:
+    """
+    Put a copy of src at dst, which must not exist.
+    :return: how it was done: "cloned", "linked" or "copied"
+    """
+    methods = {"auto": ("reflink", "hardlink"), "reflink": ("reflink",), "hardlink": ("hardlink",)}.get(mode, ())
+    devices = src.stat().st_dev, dst.parent.stat().st_dev
+
+    for method in methods:
+        key = (method, *devices)
+        if key in _unsupported:
+            continue
+
+        try:
+            if method == "reflink":
+                _reflink(src, dst)
+                return "cloned"
+            else:
+                os.link(src, dst)
+                return "linked"
+        except OSError as e:
+            logging.info("Can't %s %s to %s (%s), falling back", method, src, dst, e)
+            with _lock:
+                _unsupported.add(key)
+
+    shutil.copy2(src, dst)
+    return "copied"
+
+
+def _unchanged(src: pathlib.Path, dst: pathlib.Path, mode: str) -> bool:
+    try:
+        sst, dstat = src.stat(), dst.lstat()
+    except FileNotFoundError:
+        return False
+
+    if not dst.is_file() or dst.is_symlink() or sst.st_size != dstat.st_size:
+        return False
+    if (sst.st_dev, sst.st_ino) == (dstat.st_dev, dstat.st_ino):
+        # a hardlink from an earlier install. Replace it with a real copy if hardlinks aren't wanted any more
+        return mode in ("auto", "hardlink")
+    if sst.st_mtime_ns == dstat.st_mtime_ns:
+        return True
+
+    # Only the mtime differs, e.g. after a checkout. Compare contents, then remember them as equal
+    if file_hash(src) == file_hash(dst):
+        shutil.copystat(src, dst)
+        return True
+    return False
+
+
+def _remove(path: pathlib.Path):
+    if path.is_dir() and not path.is_symlink():
+        rmtree(path)
+    else:
+        path.unlink()
+
+
+def sync_tree(src: pathlib.Path, dst: pathlib.Path, ignore: Iterable[str] = (),
+              mode: Optional[str] = None) -> Counter[str]:
+    """
+    Make dst a copy of src, except for ignored paths. Only files whose size, mtime or contents have changed are
+    replaced, and anything in dst that isn't in src is removed. Symlinks are copied as symlinks.
+    :param ignore: patterns, on top of DEFAULT_IGNORE. See DEFAULT_IGNORE for the syntax
+    :param mode: one of LINK_MODES. Defaults to the link-mode cookie
+    :return: number of files "cloned", "linked", "copied", "unchanged" and "removed"
+    """
+    patterns = (*DEFAULT_IGNORE, *ignore)
+    mode = mode or link_mode()
+    stats = Counter()
+
+    if dst.is_symlink() or (dst.exists() and not dst.is_dir()):
+        dst.unlink()
+    dst.mkdir(parents=True, exist_ok=True)
+
+    for root, dirs, files in src.walk():
+        rel = root.relative_to(src)
+        target_root = dst / rel
+
+        wanted = set()
+        for name in dirs + files:
+            path = root / name
+            # symlinks to folders are copied as symlinks, so they are treated as files here
+            is_dir = path.is_dir() and not path.is_symlink()
+            if not is_ignored(rel / name, is_dir, patterns):
+                wanted.add(name)
+        dirs[:] = [d for d in dirs if d in wanted and not (root / d).is_symlink()]
+
+        for existing in target_root.iterdir():
+            if existing.name not in wanted:
+                _remove(existing)
+                stats["removed"] += 1
+
+        for name in sorted(wanted):
+            path, target = root / name, target_root / name
+
+            if path.is_symlink():
+                link = os.readlink(path)
+                if target.is_symlink() and os.readlink(target) == link:
+                    stats["unchanged"] += 1
+                    continue
+                if target.exists() or target.is_symlink():
+                    _remove(target)
+                target.symlink_to(link)
+                stats["copied"] += 1
+
+            elif path.is_dir():
+                if target.is_symlink() or target.is_file():
+                    target.unlink()
+                target.mkdir(exist_ok=True)
+
+            elif _unchanged(path, target, mode):
+                stats["unchanged"] += 1
+
+            else:
+                # Build the new file next to the old one, then swap, so that hardlinked sources are never written to
+                tmp = target.with_name(f".{name}.inflator-tmp")
+                tmp.unlink(missing_ok=True)
+                stats[_place(path, tmp, mode)] += 1
+                if target.is_dir() and not target.is_symlink():
+                    rmtree(target)
+                os.replace(tmp, target)
+
+    logging.info("Synced %s to %s: %s", src, dst, dict(stats))
+    return stats
@@ -0,0 +1,313 @@
+# The resolved dependency graph of a project: one node per package id, with topological waves and cycle detection
+from __future__ import annotations
+
+import dataclasses
+import json
+import logging
+import pathlib
+
+from collections import deque
+from typing import Any, Optional
+
+from inflator import package
+
+
+class CycleError(RecursionError):
+    """
+    The dependency graph has cycles
+    :param cycles: each cycle as a path of packages, starting and ending with the same one
+    """
+    def __init__(self, cycles: list[list[package.Package]]):
+        self.cycles = cycles
+        super().__init__("Circular dependencies:" + ''.join(
+            "\n- " + " -> ".join(pkg.name for pkg in cycle) for cycle in cycles))
+
+
+def key(pkg: package.Package) -> str:
+    return f"{pkg.username}/{pkg.reponame}/{pkg.version}"
+
+
+class DependencyGraph:
+    def __init__(self):
+        self.nodes: dict[str, package.Package] = {}
+        # id -> [(importname, dependency id)]
+        self.edges: dict[str, list[tuple[str, str]]] = {}
+        # the project's own dependencies, as (importname, id)
+        self.roots: list[tuple[str, str]] = []
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def add(self, pkg: package.Package) -> tuple[package.Package, bool]:
+        """
+        Add a node, unless there already is one with the same id
+        :return: the node for pkg.id, and whether it was new
+        """
+        if pkg.id in self.nodes:
+            return self.nodes[pkg.id], False
+        self.nodes[pkg.id] = pkg
+        self.edges[pkg.id] = []
+        return pkg, True
+
+    def add_edge(self, src: Optional[package.Package], importname: str, dst: package.Package):
+        """
+        :param src: the dependent, or None for a dependency of the project itself
+        """
+        edge = importname, self.add(dst)[0].id
+        if src is None:
+            self.roots.append(edge)
+        else:
+            self.edges[src.id].append(edge)
+
+    def dependencies(self, pkg: package.Package) -> list[package.Package]:
+        return [self.nodes[dep] for _, dep in self.edges[pkg.id]]
+
+    @classmethod
+    def from_installed(cls, roots: list[package.Package], nodes: dict[str, package.Package]) -> DependencyGraph:
+        """
+        Graph of what install_packages installed
+        :param roots: the packages passed to install_packages
+        :param nodes: what install_packages returned
+        """
+        self = cls()
+        todo = deque()
+
+        for root in roots:
+            if root.id in nodes:
+                node, new = self.add(nodes[root.id])
+                self.add_edge(None, root.importname, node)
+                if new:
+                    todo.append(node)
+
+        while todo:
+            pkg = todo.popleft()
+            for dep in pkg.deps:
+                if dep.id not in nodes:
+                    # not installed, e.g. because it was missing while offline
+                    continue
+                node, new = self.add(nodes[dep.id])
+                self.add_edge(pkg, dep.importname, node)
+                if new:
+                    todo.append(node)
+
+        return self
+
+    @classmethod
+    def from_project(cls, path: pathlib.Path) -> DependencyGraph:
+        """
+        Resolve every package used by the project at path against the installed packages. Each package's
+        dependencies are only read once, however many dependents it has
+        """
+        logging.info("Building dependency graph of %s", path)
+        self = cls()
+        todo = deque([(None, package.Package.from_raw(str(path)))])
+
+        while todo:
+            parent, pkg = todo.popleft()
+            for dep in pkg.deps:
+                dep.resolve()
+                node, new = self.add(dep)
+                self.add_edge(parent, dep.importname, node)
+                if new:
+                    todo.append((node, node))
+
+        return self
+
+    @classmethod
+    def from_lock(cls, data: dict[str, Any]) -> DependencyGraph:
+        """
+        Graph of an inflator.lock, without reading anything else
+        """
+        self = cls()
+        by_key = {}
+        for lock_key, entry in data["packages"].items():
+            by_key[lock_key] = self.add(package.Package(
+                username=entry["username"], reponame=entry["reponame"], version=entry["version"],
+                backpack_only=entry["placement"] == "backpack"))[0]
+
+        for importname, lock_key in data["dependencies"].items():
+            self.add_edge(None, importname, by_key[lock_key])
+        for lock_key, entry in data["packages"].items():
+            for importname, dep_key in entry["dependencies"].items():
+                self.add_edge(by_key[lock_key], importname, by_key[dep_key])
+
+        return self
+
+    def links(self) -> list[package.Package]:
+        """
+        Every (package, importname) pair that needs to be symlinked into the project, as copies of the nodes with
+        importname set
+        """
+        ret = []
+        seen = set()
+        todo = deque(self.roots)
+        while todo:
+            importname, node_id = todo.popleft()
+            if (importname, node_id) in seen:
+                continue
+            seen.add((importname, node_id))
+
+            ret.append(dataclasses.replace(self.nodes[node_id], importname=importname))
+            todo.extend(self.edges[node_id])
+
+        return ret
+
+    def _sccs(self) -> list[list[str]]:
+        # Tarjan's strongly connected components, iteratively so that deep graphs don't hit the recursion limit
+        index: dict[str, int] = {}
+        low: dict[str, int] = {}
+        stack: list[str] = []
+        on_stack: set[str] = set()
+        ret = []
+
+        for start in self.nodes:
+            if start in index:
+                continue
+
+            index[start] = low[start] = len(index)
+            stack.append(start)
+            on_stack.add(start)
+            work = [(start, iter(self.edges[start]))]
+
+            while work:
+                node, successors = work[-1]
+                for _, succ in successors:
+                    if succ not in index:
+                        index[succ] = low[succ] = len(index)
+                        stack.append(succ)
+                        on_stack.add(succ)
+                        work.append((succ, iter(self.edges[succ])))
+                        break
+                    elif succ in on_stack:
+                        low[node] = min(low[node], index[succ])
+                else:
+                    work.pop()
+                    if work:
+                        parent = work[-1][0]
+                        low[parent] = min(low[parent], low[node])
+
+                    if low[node] == index[node]:
+                        component = []
+                        while True:
+                            member = stack.pop()
+                            on_stack.discard(member)
+                            component.append(member)
+                            if member == node:
+                                break
+                        ret.append(component)
+
+        return ret
+
+    def cycles(self) -> list[list[package.Package]]:
+        """
+        One cycle through each group of packages that depend on each other, as a path that starts and ends with the
+        same package
+        """
+        ret = []
+        for component in self._sccs():
+            start = component[0]
+            members = set(component)
+            if len(component) == 1 and start not in (dep for _, dep in self.edges[start]):
+                continue
+
+            # shortest way back to start, staying inside the component
+            came_from: dict[str, str] = {}
+            todo = deque([start])
+            while todo:
+                node = todo.popleft()
+                if start in (dep for _, dep in self.edges[node]):
+                    path = [start, node]
+                    while node != start:
+                        node = came_from[node]
+                        path.append(node)
+                    ret.append([self.nodes[i] for i in reversed(path)])
+                    break
+
+                for _, dep in self.edges[node]:
+                    if dep in members and dep not in came_from and dep != start:
+                        came_from[dep] = node
+                        todo.append(dep)
+
+        return ret
+
+    def check(self):
+        """
+        :raises CycleError: if there are any cycles
+        """
+        if cycles := self.cycles():
+            raise CycleError(cycles)
+
+    def waves(self) -> list[list[package.Package]]:
+        """
+        Group the packages so that each group only depends on earlier ones. The packages in a group are independent
+        of each other, so can be installed at the same time
+        :raises CycleError: if there are cycles, since they can't be ordered
+        """
+        remaining = {node_id: len({dep for _, dep in edges}) for node_id, edges in self.edges.items()}
+        dependents: dict[str, set[str]] = {node_id: set() for node_id in self.nodes}
+        for node_id, edges in self.edges.items():
+            for _, dep in edges:
+                dependents[dep].add(node_id)
+
+        ret = []
+        wave = sorted(node_id for node_id, count in remaining.items() if count == 0)
+        while wave:
+            ret.append([self.nodes[node_id] for node_id in wave])
+            after = []
+            for node_id in wave:
+                for dependent in dependents[node_id]:
+                    remaining[dependent] -= 1
+                    if remaining[dependent] == 0:
+                        after.append(dependent)
+            wave = sorted(after)
+
+        if sum(len(w) for w in ret) != len(self.nodes):
+            self.check()
+        return ret
+
+    def topological_order(self) -> list[package.Package]:
+        """
+        Every package, after all of its dependencies
+        """
+        return [pkg for wave in self.waves() for pkg in wave]
+
+    def to_json(self) -> dict[str, Any]:
+        return {
+            "dependencies": {importname: key(self.nodes[node_id]) for importname, node_id in self.roots},
+            "packages": {key(pkg): {
+                "username": pkg.username,
+                "reponame": pkg.reponame,
+                "version": pkg.version,
+                "dependencies": {importname: key(self.nodes[dep]) for importname, dep in self.edges[node_id]},
+            } for node_id, pkg in self.nodes.items()},
+            "cycles": [[key(pkg) for pkg in cycle] for cycle in self.cycles()],
+        }
+
+    def to_dot(self) -> str:
+        lines = ["digraph dependencies {", '  "project" [shape=box];']
+        for pkg in self.nodes.values():
+            lines.append(f"  {json.dumps(key(pkg))} [label={json.dumps(pkg.name)}];")
+        for importname, node_id in self.roots:
+            lines.append(f'  "project" -> {json.dumps(key(self.nodes[node_id]))} [label={json.dumps(importname)}];')
+        for node_id, edges in self.edges.items():
+            for importname, dep in edges:
+                lines.append(f"  {json.dumps(key(self.nodes[node_id]))} -> {json.dumps(key(self.nodes[dep]))} "
+                             f"[label={json.dumps(importname)}];")
+        lines.append("}")
+        return '\n'.join(lines)
+
+    def to_text(self) -> str:
+        cycles = self.cycles()
+        lines = [f"{len(self.nodes)} packages, {sum(len(e) for e in self.edges.values()) + len(self.roots)} edges"]
+
+        if cycles:
+            lines.append(str(CycleError(cycles)))
+        else:
+            for i, wave in enumerate(self.waves()):
+                lines.append(f"Wave {i}:")
+                lines += [f"- {pkg.name}" + ''.join(f"\n    {importname} -> {self.nodes[dep].name}"
+                                                   for importname, dep in self.edges[pkg.id])
+                          for pkg in wave]
+
+        return '\n'.join(lines)
+
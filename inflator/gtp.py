@@ -1,21 +1,82 @@
+# The gtp registry: short names for goboscript packages. Cached on disk, revalidated with ETags once the TTL runs out
 from __future__ import annotations
 
 import json
+import logging
+import threading
+import time
 
 from base64 import b64decode
 
-from inflator.cookies import gh
+from inflator.cookies import cookies
+from inflator.net import api_base, api_headers, ensure_online, is_offline, request
+from inflator.profile import profiler
+from inflator.util import APPDATA_FARETEK_CACHE, read_json, write_json
 
-_repo = None
-def repo():
-    global _repo
+GTP_REPO = "inflated-goboscript/gtp"
+# Configure with `inflate set gtp-cache-ttl <seconds>`
+DEFAULT_TTL = 60 * 60
 
-    if not _repo:
-        _repo = gh.get_repo("inflated-goboscript/gtp")
+# Set to ignore the on-disk cache for the next load() in this process
+force_refresh = False
 
-    return _repo
+_data: dict[str, dict[str, str]] | None = None
+_lock = threading.Lock()
 
-def load() -> dict[str, dict[str, str]]:
-    raw_data = repo().get_contents("gtp.json")
-    assert raw_data is not None, "No data. Something went wrong with GitHub api. raise issue on gh"
-    return json.loads(b64decode(raw_data.content).decode())
+
+def _cache_path():
+    return APPDATA_FARETEK_CACHE / "gtp.json"
+
+
+def ttl() -> float:
+    return float(cookies.get("gtp-cache-ttl", DEFAULT_TTL))
+
+
+def load(refresh: bool = False) -> dict[str, dict[str, str]]:
+    """
+    Get the gtp registry. Memoized for the rest of the process, so resolving many names costs at most 1 request
+    :param refresh: ignore both the memo and the on-disk cache
+    """
+    global _data, force_refresh
+
+    with _lock:
+        refresh = refresh or force_refresh
+        if _data is not None and not refresh:
+            return _data
+
+        with profiler.phase("gtp"):
+            _data = _fetch(refresh)
+
+        force_refresh = False
+        return _data
+
+
+def _fetch(refresh: bool) -> dict[str, dict[str, str]]:
+    cached = read_json(_cache_path())
+    if cached and is_offline():
+        logging.info("Offline, so using cached gtp")
+        return cached["data"]
+    ensure_online("the gtp registry")
+
+    if cached and not refresh and time.time() - cached["fetched"] < ttl():
+        logging.info("Using cached gtp")
+        return cached["data"]
+
+    resp = request("GET", f"{api_base()}/repos/{GTP_REPO}/contents/gtp.json",
+                   headers=api_headers(cached["etag"] if cached and not refresh else None))
+
+    if resp.status_code == 304:
+        logging.info("gtp not modified")
+        data = cached["data"]
+        etag = cached["etag"]
+    else:
+        resp.raise_for_status()
+        raw_data = resp.json()
+        assert "content" in raw_data, "No data. Something went wrong with GitHub api. raise issue on gh"
+
+        data = json.loads(b64decode(raw_data["content"]).decode())
+        etag = resp.headers.get("ETag")
+        logging.info("Fetched gtp with %d entries", len(data))
+
+    write_json(_cache_path(), {"etag": etag, "fetched": time.time(), "data": data})
+    return data
@@ -0,0 +1,257 @@
+# Index of everything installed in APPDATA_FARETEK_PKGS, so that searching doesn't have to walk and parse package trees
+from __future__ import annotations
+
+import fnmatch
+import logging
+import os
+import pathlib
+import threading
+import tomllib
+
+from contextlib import contextmanager
+from typing import Any, Optional
+
+from inflator import parse, version
+from inflator.util import APPDATA_FARETEK_INFLATE, APPDATA_FARETEK_PKGS, SOURCE_FILE, file_lock, read_json, write_json
+
+INDEX_VERSION = 1
+
+_lock = threading.Lock()
+_entries: Optional[dict[str, dict[str, Any]]] = None
+_signature: Optional[tuple[int, int]] = None
+_generation = 0
+# Changes (None for removals) not written to the file yet, because a batch() is open
+_pending: dict[str, Optional[dict[str, Any]]] = {}
+_batches = 0
+
+
+def _index_path():
+    return APPDATA_FARETEK_INFLATE / "index.json"
+
+
+def _lock_path():
+    return APPDATA_FARETEK_INFLATE / "index.lock"
+
+
+def _key(username: str, reponame: str, version: str):
+    return f"{username}/{reponame}/{version}"
+
+
+def _stat_signature():
+    try:
+        st = _index_path().stat()
+    except FileNotFoundError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+def make_entry(path: pathlib.Path, username: str, reponame: str, version: str,
+               commit: Optional[str] = None, sha256: Optional[str] = None) -> dict[str, Any]:
+    """
+    Read the metadata of an installed package. Only its own tomls are read - dependencies are not resolved.
+    Where it came from is read from its SOURCE_FILE, unless given
+    :param commit: commit the package was installed from, if it came from gh
+    :param sha256: hash of the zipball the package was installed from, if it came from gh, or of its files
+    (see util.tree_hash) if it was upgraded by delta
+    """
+    # editable installs are symlinks to the source, so are always local
+    source = {"local": True} if path.is_symlink() else read_json(path / SOURCE_FILE, {})
+    iftoml, gstoml = path / "inflator.toml", path / "goboscript.toml"
+    deps = []
+
+    if iftoml.exists():
+        with open(iftoml, "rb") as f:
+            deps += parse.iftoml_deps(tomllib.load(f))
+    if gstoml.exists():
+        with open(gstoml, "rb") as f:
+            deps += parse.gstoml_deps(tomllib.load(f))
+
+    return {
+        "username": username,
+        "reponame": reponame,
+        "version": version,
+        "backpack_only": (not iftoml.exists()) and gstoml.exists(),
+        "deps": deps,
+        "path": str(path),
+        # None for packages installed before SOURCE_FILE was written
+        "local": source.get("local"),
+        "commit": commit or source.get("commit"),
+        "sha256": sha256 or source.get("sha256"),
+    }
+
+
+def _scan() -> dict[str, dict[str, Any]]:
+    entries = {}
+    if not APPDATA_FARETEK_PKGS.exists():
+        return entries
+
+    for user_dir in APPDATA_FARETEK_PKGS.iterdir():
+        if not user_dir.is_dir():
+            continue
+        for repo_dir in user_dir.iterdir():
+            if not repo_dir.is_dir():
+                continue
+            for version_dir in repo_dir.iterdir():
+                # editable installs are symlinks
+                if version_dir.is_dir() or version_dir.is_symlink():
+                    entries[_key(user_dir.name, repo_dir.name, version_dir.name)] = \
+                        make_entry(version_dir, user_dir.name, repo_dir.name, version_dir.name)
+
+    return entries
+
+
+def generation() -> int:
+    """
+    Incremented whenever the index changes, so that anything derived from it knows when to be recomputed
+    """
+    with _lock:
+        _load()
+        return _generation
+
+
+def _apply(entries: dict[str, dict[str, Any]]) -> dict[str, dict[str, Any]]:
+    # Put this process's unwritten changes on top of entries
+    for key, item in _pending.items():
+        if item is None:
+            entries.pop(key, None)
+        else:
+            entries[key] = item
+    return entries
+
+
+def _flush():
+    # Must be called with _lock held. Merges the pending changes into the file under an inter-process lock, so that
+    # concurrent inflate processes don't drop each other's entries
+    global _entries, _signature, _generation
+
+    with file_lock(_lock_path()):
+        data = read_json(_index_path())
+        if not data or data.get("version") != INDEX_VERSION:
+            logging.info("Index missing or outdated, rebuilding it")
+            entries = _scan()
+        else:
+            entries = data["packages"]
+
+        write_json(_index_path(), {"version": INDEX_VERSION, "packages": _apply(entries)})
+        _entries, _signature = entries, _stat_signature()
+        _pending.clear()
+
+    _generation += 1
+
+
+def _load() -> dict[str, dict[str, Any]]:
+    # Must be called with _lock held. Only re-reads the file if another process changed it
+    global _entries, _signature, _generation
+
+    signature = _stat_signature()
+    if _entries is not None and signature == _signature:
+        return _entries
+
+    data = read_json(_index_path())
+    if not data or data.get("version") != INDEX_VERSION:
+        _flush()
+    else:
+        _entries, _signature = _apply(data["packages"]), signature
+        _generation += 1
+
+    return _entries
+
+
+def _change(key: str, item: Optional[dict[str, Any]], flush: bool = True):
+    # Must be called with _lock held. Visible to this process at once, but only written when no batch is open
+    global _generation
+
+    entries = _load()
+    if item is None:
+        if entries.pop(key, None) is None and key not in _pending:
+            return
+    else:
+        entries[key] = item
+
+    _pending[key] = item
+    _generation += 1
+    if flush and not _batches:
+        _flush()
+
+
+@contextmanager
+def batch():
+    """
+    Write the changes made inside the with block once, at the end, instead of rewriting the index for every
+    installed package. Can be nested, and used from several threads at once
+    """
+    global _batches
+
+    with _lock:
+        _batches += 1
+    try:
+        yield
+    finally:
+        with _lock:
+            _batches -= 1
+            if not _batches and _pending:
+                _flush()
+
+
+def rebuild():
+    """
+    Re-scan the package store. Only needed if it was changed by something other than inflator
+    """
+    global _entries, _signature, _generation
+
+    with _lock, file_lock(_lock_path()):
+        entries = _scan()
+        write_json(_index_path(), {"version": INDEX_VERSION, "packages": entries})
+        _entries, _signature = entries, _stat_signature()
+        _pending.clear()
+        _generation += 1
+
+
+def add(path: pathlib.Path, username: str, reponame: str, version: str,
+        commit: Optional[str] = None, sha256: Optional[str] = None):
+    item = make_entry(path, username, reponame, version, commit, sha256)
+    with _lock:
+        _change(_key(username, reponame, version), item)
+
+
+def remove(username: str, reponame: str, version: str):
+    with _lock:
+        _change(_key(username, reponame, version), None)
+
+
+def query(usernames: list[str], reponames: list[str], versions: list[str], globbed: bool = True) \
+        -> list[dict[str, Any]]:
+    """
+    Find installed packages. Empty lists match anything. usernames and reponames should be lowercase.
+    When globbed, versions can also be ranges (see version.matches).
+    Entries whose folder has been deleted are dropped.
+    :return: entries, sorted by username, reponame then newest version first
+    """
+    def match_l(pats, value, match=fnmatch.fnmatch):
+        if globbed:
+            return not pats or any(match(value, p) for p in pats)
+        else:
+            return not pats or value in pats
+
+    with _lock:
+        entries = _load()
+
+        matches = {key: item for key, item in entries.items()
+                   if match_l(usernames, item["username"].lower())
+                   and match_l(reponames, item["reponame"].lower())
+                   and match_l(versions, item["version"], version.matches)}
+
+        stale = {key for key, item in matches.items() if not os.path.lexists(item["path"])}
+        if stale:
+            logging.info("Dropping %d stale index entries", len(stale))
+            for key in stale:
+                _change(key, None, flush=False)
+            if not _batches:
+                _flush()
+
+    results = [item for key, item in matches.items() if key not in stale]
+
+    # Make newer versions come first
+    results.sort(key=lambda item: version.sort_key(item["version"]), reverse=True)
+    results.sort(key=lambda item: (item["username"], item["reponame"]))
+    return results
@@ -0,0 +1,132 @@
+# inflator.lock: the fully resolved dependency graph of a project, so that installs and syncs don't need to resolve
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import pathlib
+import tomllib
+
+from typing import Any, Optional
+
+from inflator import graph, package, version
+from inflator.util import file_hash, read_json, write_json
+
+LOCK_NAME = "inflator.lock"
+LOCK_VERSION = 1
+MANIFEST_NAMES = ("inflator.toml", "goboscript.toml")
+
+
+def deps_hash(toml: dict) -> str:
+    """
+    Hash of the dependency table of a manifest. Other keys (name, version, etc) don't affect the lock
+    """
+    return hashlib.sha256(json.dumps(toml.get("dependencies", {}), sort_keys=True).encode()).hexdigest()
+
+
+def local_manifests(path: pathlib.Path) -> dict[str, str]:
+    """
+    sha256 of each manifest of a local package. Its version and dependencies can change at any time, which makes the
+    lock stale
+    """
+    return {name: file_hash(path / name) for name in MANIFEST_NAMES if (path / name).exists()}
+
+
+def read(directory: pathlib.Path) -> Optional[dict[str, Any]]:
+    data = read_json(directory / LOCK_NAME)
+    if data is not None and data.get("version") != LOCK_VERSION:
+        logging.warning("Ignoring %s with unknown version %r", LOCK_NAME, data.get("version"))
+        return None
+    return data
+
+
+def is_fresh(data: dict[str, Any], directory: pathlib.Path, manifests: Optional[list[str]] = None) -> bool:
+    """
+    Whether the lock was made from exactly these manifests, and neither they nor the manifests of locked local packages
+    have changed since
+    :param manifests: names of the manifests that the lock should cover.
+    Defaults to every manifest in directory that has dependencies
+    """
+    if manifests is None:
+        manifests = []
+        for name in MANIFEST_NAMES:
+            if (directory / name).exists():
+                with open(directory / name, "rb") as f:
+                    if tomllib.load(f).get("dependencies"):
+                        manifests.append(name)
+
+    if set(data["manifests"]) != set(manifests):
+        return False
+
+    for name, expected in data["manifests"].items():
+        with open(directory / name, "rb") as f:
+            if deps_hash(tomllib.load(f)) != expected:
+                return False
+
+    for entry in data["packages"].values():
+        if "path" in entry and local_manifests(pathlib.Path(entry["path"])) != entry.get("manifests"):
+            return False
+
+    return True
+
+
+def write(manifest: pathlib.Path, toml: dict, roots: list[package.Package], nodes: dict[str, package.Package]):
+    """
+    Write the lock for a manifest, after its dependencies have been installed.
+    :param roots: the dependencies of the manifest, as passed to install_packages
+    :param nodes: the graph returned by install_packages
+    """
+    dependencies = graph.DependencyGraph.from_installed(roots, nodes)
+    packages = {}
+
+    for node_id, node in dependencies.nodes.items():
+        if not node.version or not version.is_exact(node.version):
+            raise ValueError(f"Can't lock {node.name}: its version {node.version!r} isn't pinned")
+
+        entry = packages[graph.key(node)] = {
+            "username": node.username,
+            "reponame": node.reponame,
+            "version": node.version,
+            "placement": node.symlink_folder,
+        }
+        if node.is_local:
+            entry["path"] = str(node.local_path)
+            entry["manifests"] = local_manifests(node.local_path)
+        else:
+            entry["commit"] = node.commit
+            entry["sha256"] = node.sha256
+
+        entry["dependencies"] = {importname: graph.key(dependencies.nodes[dep])
+                                 for importname, dep in dependencies.edges[node_id]}
+
+    data = {
+        "version": LOCK_VERSION,
+        "manifests": {manifest.name: deps_hash(toml)},
+        "dependencies": {importname: graph.key(dependencies.nodes[node_id])
+                         for importname, node_id in dependencies.roots},
+        "packages": packages,
+    }
+
+    path = manifest.parent / LOCK_NAME
+    write_json(path, data, indent=2)
+    print(f"Wrote {path} with {len(packages)} packages")
+
+
+def packages(data: dict[str, Any]) -> list[package.Package]:
+    """
+    Every locked package, ready to be installed without any resolution
+    """
+    ret = []
+    for entry in data["packages"].values():
+        if "path" in entry:
+            pkg = package.Package.from_raw(entry["path"], version=entry["version"], username=entry["username"],
+                                           reponame=entry["reponame"])
+        else:
+            pkg = package.Package(username=entry["username"], reponame=entry["reponame"], version=entry["version"],
+                                  raw=f"https://github.com/{entry['username']}/{entry['reponame']}",
+                                  is_local=False, commit=entry["commit"], sha256=entry["sha256"])
+        pkg.backpack_only = entry["placement"] == "backpack"
+        ret.append(pkg)
+
+    return ret
+
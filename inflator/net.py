@@ -0,0 +1,190 @@
+# Talking to the GitHub API, through one shared, pooled HTTP client that retries transient failures
+from __future__ import annotations
+
+import atexit
+import importlib.util
+import logging
+import random
+import threading
+import time
+
+from typing import IO, Optional
+
+from inflator import __version__
+from inflator.cookies import cookies
+from inflator.util import CHUNK_SIZE
+
+GITHUB_API = "https://api.github.com"
+
+# Defaults of the cookies that tune the client. e.g. `inflate set http-retries 5`
+DEFAULT_TIMEOUT = 30.0  # http-timeout: seconds to wait for a connection or for data
+DEFAULT_RETRIES = 3  # http-retries: attempts after the first one, for connection errors, timeouts, 429s and 5xxs
+DEFAULT_BACKOFF = 0.5  # http-backoff: base delay in seconds. Retry n waits a random time up to backoff * 2 ** n
+DEFAULT_MAX_CONNECTIONS = 16  # http-max-connections
+# http2: "auto" uses HTTP/2 if the h2 package is installed (pip install httpx[http2])
+MAX_RETRY_AFTER = 60.0
+
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+_client = None
+_client_lock = threading.Lock()
+
+# Set by `inflate install --offline`. Can also be turned on for good with `inflate set offline true`
+offline = False
+
+
+class OfflineError(RuntimeError):
+    """
+    Something had to be fetched from GitHub while offline
+    :param missing: descriptions of everything that wasn't available locally
+    """
+    def __init__(self, missing: list[str]):
+        self.missing = missing
+        super().__init__("Offline, and these are not available locally:" + ''.join(f"\n- {m}" for m in missing))
+
+
+def _flag(name: str, default: bool = False) -> bool:
+    value = cookies.get(name)
+    if value is None or value == "":
+        return default
+    return str(value).lower() in ("1", "true", "yes", "on")
+
+
+def is_offline() -> bool:
+    return offline or _flag("offline")
+
+
+def ensure_online(what: str):
+    """
+    Raise OfflineError instead of making a request while offline, so that nothing waits on a network timeout
+    :param what: what the request was going to fetch
+    """
+    if is_offline():
+        raise OfflineError([what])
+
+
+def api_base() -> str:
+    """
+    Root of the GitHub REST API. Point it at a mirror or a local stand-in with `inflate set github-api <url>`
+    """
+    return str(cookies.get("github-api") or GITHUB_API).rstrip('/')
+
+
+def api_headers(etag: Optional[str] = None) -> dict[str, str]:
+    """
+    Headers for a GitHub REST request. Uses the auth-token cookie if set.
+    :param etag: ETag of a cached response, to make the request conditional. A 304 doesn't count against the rate limit
+    """
+    headers = {"Accept": "application/vnd.github+json"}
+
+    if token := cookies.get("auth-token"):
+        headers["Authorization"] = f"Bearer {token}"
+    if etag:
+        headers["If-None-Match"] = etag
+
+    return headers
+
+
+def client():
+    """
+    The HTTP client shared by everything in the process, so that connections (and TLS sessions) are reused.
+    Made when first needed, from the http-* cookies
+    """
+    global _client
+    import httpx
+
+    with _client_lock:
+        if _client is None:
+            http2 = cookies.get("http2", "auto")
+            if http2 == "auto":
+                http2 = importlib.util.find_spec("h2") is not None
+            else:
+                http2 = _flag("http2")
+
+            connections = int(cookies.get("http-max-connections", DEFAULT_MAX_CONNECTIONS))
+            _client = httpx.Client(
+                http2=http2,
+                timeout=float(cookies.get("http-timeout", DEFAULT_TIMEOUT)),
+                limits=httpx.Limits(max_connections=connections, max_keepalive_connections=connections),
+                follow_redirects=True,
+                headers={"User-Agent": f"inflator/{__version__}"},
+            )
+            atexit.register(_client.close)
+            logging.info("Made HTTP client: http2=%s, connections=%s", http2, connections)
+
+        return _client
+
+
+def retries() -> int:
+    return int(cookies.get("http-retries", DEFAULT_RETRIES))
+
+
+def _delay(attempt: int, resp=None) -> float:
+    # Full jitter, so that parallel installs that failed together don't retry together
+    if resp is not None and (retry_after := resp.headers.get("Retry-After", "")).isdigit():
+        return min(float(retry_after), MAX_RETRY_AFTER)
+    return random.uniform(0, float(cookies.get("http-backoff", DEFAULT_BACKOFF)) * 2 ** attempt)
+
+
+def _should_retry(attempt: int, what: str, error=None, resp=None) -> bool:
+    # Sleeps and returns True if there is another attempt left
+    if attempt >= retries():
+        return False
+
+    delay = _delay(attempt, resp)
+    reason = repr(error) if error is not None else resp.status_code
+    logging.warning("%s failed (%s), retrying in %.2fs (%d/%d)", what, reason, delay, attempt + 1, retries())
+    time.sleep(delay)
+    return True
+
+
+def request(method: str, url: str, **kwargs):
+    """
+    Make a request with the shared client. Connection errors, timeouts, 429s and 5xxs are retried with backoff.
+    Other statuses (including 304 and 404) are returned as they are, so check them
+    :return: httpx.Response
+    """
+    import httpx
+
+    attempt = 0
+    while True:
+        try:
+            resp = client().request(method, url, **kwargs)
+        except httpx.TransportError as e:
+            if not _should_retry(attempt, f"{method} {url}", error=e):
+                raise
+        else:
+            if resp.status_code not in RETRY_STATUSES or not _should_retry(attempt, f"{method} {url}", resp=resp):
+                return resp
+        attempt += 1
+
+
+def download(url: str, f: IO[bytes], **kwargs) -> int:
+    """
+    Stream the body of a GET into f in CHUNK_SIZE blocks. A failure part way through restarts the download,
+    with backoff, from the beginning of f
+    :return: the number of bytes written
+    """
+    import httpx
+
+    attempt = 0
+    while True:
+        f.seek(0)
+        f.truncate()
+        size = 0
+        try:
+            with client().stream("GET", url, **kwargs) as resp:
+                if resp.status_code in RETRY_STATUSES and _should_retry(attempt, f"GET {url}", resp=resp):
+                    attempt += 1
+                    continue
+                resp.raise_for_status()
+
+                for chunk in resp.iter_bytes(CHUNK_SIZE):
+                    f.write(chunk)
+                    size += len(chunk)
+                return size
+
+        except httpx.TransportError as e:
+            if not _should_retry(attempt, f"GET {url}", error=e):
+                raise
+            attempt += 1
@@ -4,12 +4,12 @@ import subprocess
 from pathlib import Path
 from typing import Optional
 
-from slugify import slugify
-
 from inflator.toml import toml as inflator_toml
 
 
 def new(name: Optional[str] = None):
+    from slugify import slugify
+
     if name is None:
         name = Path.cwd().name
         output_dir = Path.cwd()
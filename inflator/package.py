@@ -1,27 +1,35 @@
 from __future__ import annotations
 
-import fnmatch
 import logging
 import os
 import pathlib
 import hashlib
-import pprint
-import shutil
+import tempfile
+import threading
 import tomllib
 
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass, field
-from typing import Optional, Self, Any
-from zipfile import ZipFile
-from io import BytesIO
+from typing import Optional, Self, Any, Iterable
 
-import httpx
+from inflator.util import APPDATA_FARETEK_PKGS, SOURCE_FILE, TREE_HASH_PREFIX, echo, rmtree, tree_hash, write_json
+from inflator.archive import extract_zipball, top_level
+from inflator.net import OfflineError, api_base, ensure_online, is_offline
+from inflator.profile import profiler
+from inflator import delta, fileops, graph, gtp, index, net, parse, store, tags, version, zipcache
 
-from furl import furl
 
-from inflator.util import APPDATA_FARETEK_PKGS, APPDATA_FARETEK_ZIPAREA, rmtree
-from inflator.parse import parse_iftoml, parse_gstoml
-from inflator.cookies import gh
-from inflator import gtp
+# Process-wide memo of search_for_package results, shared by resolve() and already_installed.
+# Keyed by the query and the index generation, so installing anything invalidates it
+_search_memo: dict[tuple, list[Package]] = {}
+_search_memo_lock = threading.Lock()
+# "hits" and "misses" of _search_memo
+memo_stats: Counter[str] = Counter()
+
+# Tag chosen for each (username, reponame, version spec, preferred specs) in this process, see Package.fetch_tag
+_tag_memo: dict[tuple[str, str, str, tuple[str, ...]], str] = {}
+_tag_memo_lock = threading.Lock()
 
 
 @dataclass
@@ -36,7 +44,16 @@ class Package:
     is_local: Optional[bool] = None
     backpack_only: Optional[bool] = None
 
-    deps: list[Package] = field(default_factory=list)
+    # Where a gh package came from. If set before installing, the download must match
+    commit: Optional[str] = None
+    sha256: Optional[str] = None
+
+    # The version spec this package was asked for, before it was resolved. See install_packages
+    spec: Optional[str] = field(default=None, repr=False, compare=False)
+
+    # Parsed lazily, see Package.deps
+    _deps: Optional[list[Package]] = field(default=None, repr=False, compare=False)
+    _tomls: dict[str, Optional[dict[str, Any]]] = field(default_factory=dict, repr=False, compare=False)
 
     @property
     def id(self):
@@ -48,6 +65,8 @@ class Package:
     def from_raw(cls, raw: str, *, importname: Optional[str] = None, username: Optional[str] = None,
                  reponame: Optional[str] = None, version: str = '*',
                  _id: Optional[str] = None) -> Self:
+        from furl import furl
+
         f = furl(raw)
 
         if f.host:
@@ -69,7 +88,7 @@ class Package:
                 is_local = True
             else:
                 # try and fetch from the gtp
-                print("Loading from gtp: ")
+                echo("Loading from gtp: ")
                 data = gtp.load()
                 if raw in data:
                     return cls.from_raw(data[raw]["url"], importname=importname, username=username, reponame=reponame, version=version, _id=_id)
@@ -94,10 +113,27 @@ class Package:
             self.reponame = reponame
 
         if self.is_local:
-            self.resolve_toml_info()
+            self.resolve_metadata()
 
         return self
 
+    @classmethod
+    def from_index(cls, item: dict[str, Any]) -> Self:
+        """
+        Make a package from an entry of the installed package index, without reading anything from disk
+        """
+        return cls(
+            username=item["username"],
+            reponame=item["reponame"],
+            version=item["version"],
+            raw=item["path"],
+            local_path=pathlib.Path(item["path"]).resolve(),
+            is_local=True,
+            backpack_only=item["backpack_only"],
+            commit=item.get("commit"),
+            sha256=item.get("sha256"),
+        )
+
     @property
     def name(self):
         return f"{self.reponame} {self.version} by {self.username}"
@@ -106,181 +142,332 @@ class Package:
     def install_path(self):
         return APPDATA_FARETEK_PKGS / str(self.username) / self.reponame / self.version
 
-    @property
-    def zip_path(self):
-        assert self.username is not None  # You can't have a GitHub package without a username
-        return APPDATA_FARETEK_ZIPAREA / self.username / self.reponame / self.version
-
     def toml_path(self, name):
         return self.local_path / f"{name}.toml"
 
-    def toml_file(self, name):
-        return open(self.toml_path(name), "rb")
-
-    def resolve_toml_info(self, _id: Optional[str] = None):
+    def load_toml(self, name) -> Optional[dict[str, Any]]:
+        """
+        Read {name}.toml of this package, or None if it doesn't exist. Cached per instance
+        """
+        if name not in self._tomls:
+            with profiler.phase("manifest", self.name):
+                try:
+                    with open(self.toml_path(name), "rb") as f:
+                        self._tomls[name] = tomllib.load(f)
+                except FileNotFoundError:
+                    self._tomls[name] = None
+
+        return self._tomls[name]
+
+    def resolve_metadata(self):
+        """
+        Read backpack_only, username and version from the tomls. Dependencies are left alone, so this is cheap
+        """
         assert self.local_path
 
-        _id = self.id
-        self.backpack_only = (not self.toml_path("inflator").exists()) and self.toml_path("goboscript").exists()
-
-        logging.info("For self={}, iftoml_exists={}, gstoml_exists={}"
-                     .format(self,
-                             self.toml_path("inflator").exists(),
-                             self.toml_path("goboscript").exists()))
-        logging.info(f"So {self.backpack_only=}")
-
-        if self.toml_path("inflator").exists():
-            logging.info("Reading inflator.toml for name/version")
+        iftoml, gstoml = self.load_toml("inflator"), self.load_toml("goboscript")
+        self.backpack_only = iftoml is None and gstoml is not None
 
-            data = parse_iftoml(tomllib.load(self.toml_file("inflator")), _id)
+        logging.info("For self=%s, iftoml_exists=%s, gstoml_exists=%s, so backpack_only=%s",
+                     self, iftoml is not None, gstoml is not None, self.backpack_only)
 
+        if iftoml is not None:
             # prioritise existing data over toml data. e.g. a package may be by inflated-goboscript but registered
             # as by faretek1
-            if data.username and not self.username:
-                self.username = data.username
-                logging.info(f"{self.username=}")
+            if iftoml.get("username") and not self.username:
+                self.username = iftoml["username"]
+                logging.info("self.username=%r", self.username)
 
-            if data.name and not self.name:
-                self.reponame = data.name
-                logging.info(f"{self.reponame=}")
+            if iftoml.get("name") and not self.name:
+                self.reponame = iftoml["name"]
+                logging.info("self.reponame=%r", self.reponame)
 
-            if data.version and not self.version:
-                self.version = data.version
-                logging.info(f"{self.version=}")
+            if iftoml.get("version") and not self.version:
+                self.version = iftoml["version"]
+                logging.info("self.version=%r", self.version)
 
-            self.deps += data.deps
+    def resolve_toml_info(self):
+        """
+        Parse the dependencies in the tomls. This resolves each of them, so may involve gtp lookups
+        """
+        self.resolve_metadata()
 
-        if self.toml_path("goboscript").exists():
-            logging.info("Reading goboscript.toml for info")
+        _id = self.id
+        deps = []
 
-            data = parse_gstoml(tomllib.load(self.toml_file("goboscript")), _id)
+        if (iftoml := self.load_toml("inflator")) is not None:
+            logging.info("Reading inflator.toml for deps")
+            deps += parse.parse_iftoml(iftoml, _id).deps
 
-            logging.info(f"goboscript toml_data: {data}")
+        if (gstoml := self.load_toml("goboscript")) is not None:
+            logging.info("Reading goboscript.toml for deps")
+            deps += parse.parse_gstoml(gstoml, _id).deps
 
-            self.deps += data.deps
+        self._deps = deps
+        logging.info("Resolved %d deps for %s", len(deps), self.name)
 
-        logging.info(f"Resolved {self.deps=}")
+    @property
+    def deps(self) -> list[Package]:
+        """
+        Dependencies of this package. These are only parsed when first needed, so just looking at metadata is cheap.
+        Packages that haven't been downloaded yet have no known dependencies
+        """
+        if self._deps is None:
+            if self.local_path is None:
+                return []
+            self.resolve_toml_info()
 
-    def fetch_tag(self, pattern="*"):
-        logging.info(f"Looking for tag for {self} with pattern {pattern}")
+        return self._deps
+
+    def invalidate(self):
+        """
+        Forget the parsed tomls, e.g. after local_path has changed
+        """
+        self._deps = None
+        self._tomls = {}
+
+    def fetch_tag(self, pattern="*", prefer: Iterable[str] = ()):
+        """
+        Find the newest tag that satisfies a version spec: an exact tag, a glob or a range (see version.matches).
+        Memoized for the rest of the process
+        :param prefer: other specs for the same repo. If possible, the tag satisfies these as well
+        """
+        logging.info("Looking for tag for %s with pattern %s", self, pattern)
         assert not self.is_local
 
-        logging.info(f"Fetching version name from github for {self}")
+        if version.is_exact(pattern):
+            # An exact tag. If it doesn't exist, downloading it will fail anyway
+            logging.info("%r is an exact tag, so not listing tags", pattern)
+            return pattern
 
-        tags = gh.get_repo(f"{self.username}/{self.reponame}").get_tags()
+        prefer = tuple(sorted(set(prefer) - {pattern}))
+        key = (self.username.lower(), self.reponame.lower(), pattern, prefer)
+        with _tag_memo_lock:
+            if key in _tag_memo:
+                return _tag_memo[key]
 
-        logging.info(f"Collected tags: {pprint.pformat(tags)}")
+        if is_offline():
+            name = self.fetch_tag_offline(pattern, prefer)
+        else:
+            logging.info("Fetching version name from github for %s", self)
 
-        for tag in tags:
-            name = tag.name
-            if fnmatch.fnmatch(name, pattern):
-                logging.info(f"Matched tag: {name}")
-                return name
+            with profiler.phase("tags", self.name):
+                names = [tag["name"] for tag in tags.list_tags(self.username, self.reponame)]
 
-        if not tags:
-            raise ValueError("No tags to match against.")
-        else:
-            raise ValueError("Matching tag could not be found, but alternatives available. Consider choosing {!r}"
-                             .format(tags[-1].name))
+            logging.info("Collected %d tags", len(names))
 
-    def fetch_data(self):
-        logging.info(f"Trying to download {self} from gh")
+            name = _best(names, pattern, prefer)
+            if name is None:
+                if not names:
+                    raise ValueError("No tags to match against.")
+                else:
+                    raise ValueError("Matching tag could not be found, but alternatives available. "
+                                     "Consider choosing {!r}".format(version.newest_first(names)[0]))
+
+        logging.info("Matched tag: %s", name)
+        with _tag_memo_lock:
+            _tag_memo[key] = name
+        return name
+
+    def fetch_tag_offline(self, pattern="*", prefer: Iterable[str] = ()):
+        """
+        Match a version spec against what can be installed without the network: installed versions, and cached tags
+        whose zipball is in the download cache
+        """
+        names = {pkg.version for pkg in search_for_package(self.username, self.reponame, globbed=False)}
+        if entry := tags.cached(self.username, self.reponame):
+            names |= {tag["name"] for tag in entry["tags"]
+                      if zipcache.entry(self.username, self.reponame, tag["name"]) is not None}
+
+        if (name := _best(names, pattern, prefer)) is not None:
+            return name
+
+        raise OfflineError([f"{self.username}/{self.reponame} {pattern} (available locally: "
+                            f"{', '.join(version.newest_first(names)) or 'nothing'})"])
+
+    def fetch_data(self) -> pathlib.Path:
+        """
+        Stream the zipball of this version into a temporary file. The caller is responsible for deleting it
+        """
+        ensure_online(f"zipball of {self.username}/{self.reponame} {self.version}")
+
+        import httpx
+
+        logging.info("Trying to download %s from gh", self)
         assert not self.is_local
 
+        fd, name = tempfile.mkstemp(prefix=f"{self.reponame}-", suffix=".zip")
+        path = pathlib.Path(name)
+
         try:
-            resp = httpx.get(
-                f"https://api.github.com/repos/{self.username}/{self.reponame}/zipball/refs/tags/{self.version}",
-                follow_redirects=True).raise_for_status()
+            with profiler.phase("download", self.name) as info, os.fdopen(fd, "wb") as f:
+                size = info["bytes"] = net.download(
+                    f"{api_base()}/repos/{self.username}/{self.reponame}/zipball/refs/tags/{self.version}", f)
+
         except httpx.HTTPError as e:
-            e.add_note(f"Tag seems to be invalid. Maybe you meant {self.fetch_tag()!r}?")
+            path.unlink(missing_ok=True)
+            if isinstance(e, httpx.HTTPStatusError) and e.response.status_code == 404:
+                # Only suggest tags that are already known, rather than making another request just for the note
+                known = tags.cached(self.username, self.reponame)
+                if known and known["tags"]:
+                    e.add_note(f"Tag {self.version!r} seems to be invalid. Maybe you meant "
+                               f"{version.newest_first(t['name'] for t in known['tags'])[0]!r}?")
+                else:
+                    e.add_note(f"Tag {self.version!r} seems to be invalid")
             raise e
 
-        logging.info(f"Downloaded {resp.content.__sizeof__()} bytes with status code {resp.status_code}")
+        logging.info("Downloaded %d bytes", size)
 
-        return resp.content
+        return path
 
     @property
     def already_installed(self):
         pks = search_for_package(self.username, self.reponame, self.version)
 
         if pks:
-            print("Found {} existing installation(s): {}"
-                  .format(len(pks),
-                          ''.join(f"\n- {pk.name}" for pk in pks)))
+            echo("Found {} existing installation(s): {}"
+                 .format(len(pks),
+                         ''.join(f"\n- {pk.name}" for pk in pks)))
             return True
 
         return False
 
-    def install(self, ids: Optional[list[str]] = None, editable: bool = False, upgrade: bool = False):
-        if ids is None:
-            ids = [self.id]
-        elif self.id in ids:
-            # not that you are allowed to depend on an old version of yourself
-            raise RecursionError(f"Circular import of {self}")
+    def install(self, ids: Optional[list[str]] = None, editable: bool = False, upgrade: bool = False,
+                jobs: int = 1):
+        return install_packages([self], ids=ids, editable=editable, upgrade=upgrade, jobs=jobs)
 
+    def resolve_version(self, prefer: Iterable[str] = ()):
+        """
+        Pin the version of a gh package to an actual tag. Local packages are pinned to the version in their manifest,
+        or if it has none, to the newest installed version that fits
+        :param prefer: see fetch_tag
+        """
         if self.is_local:
-            if not upgrade:
-                if self.already_installed:
-                    return
+            if not version.is_exact(self.version or "*"):
+                spec, self.version = self.version or "*", None
+                self.resolve_metadata()
+                if self.version is None:
+                    installed = search_for_package(self.username, self.reponame, spec)
+                    self.version = max(installed, key=lambda pk: version.sort_key(pk.version)).version \
+                        if installed else spec
+                elif not version.matches(self.version, spec):
+                    logging.warning("%s doesn't match %r, but is the version at %s", self.name, spec, self.local_path)
+            return
+
+        if not self.version:
+            self.version = "*"
+        self.version = self.fetch_tag(self.version, prefer)
+
+    def install_self(self, editable: bool = False, upgrade: bool = False) -> bool:
+        """
+        Install this package, but not its dependencies. The version should already be resolved.
+        If it is already installed, gh packages are pointed at the installation so that their deps can be read.
+        :return: whether anything was installed
+        """
+        if not upgrade:
+            if self.already_installed:
+                if not self.is_local:
+                    installed = search_for_package(self.username, self.reponame, self.version)[0]
+                    self.commit, self.sha256 = installed.commit, installed.sha256
+                    self.local_path = installed.local_path
+                    self.invalidate()
+                    self.resolve_metadata()
+                return False
 
-            logging.info(f"Installing local package {self}")
-            logging.info(f"Installing into {self.install_path}")
+        if self.is_local:
+            logging.info("Installing local package %s", self)
+            logging.info("Installing into %s", self.install_path)
 
-            if self.install_path.is_symlink():
-                self.install_path.unlink()
-            else:
-                rmtree(self.install_path, ignore_errors=True)
+            index.remove(str(self.username), self.reponame, self.version)
 
             if editable:
-                os.makedirs(pathlib.Path(*self.install_path.parts[:-1]), exist_ok=True)
-                self.install_path.symlink_to(self.local_path)
+                if self.install_path.is_symlink():
+                    self.install_path.unlink()
+                else:
+                    rmtree(self.install_path, ignore_errors=True)
+
+                with profiler.phase("symlink", self.name):
+                    os.makedirs(pathlib.Path(*self.install_path.parts[:-1]), exist_ok=True)
+                    self.install_path.symlink_to(self.local_path)
             else:
-                shutil.copytree(self.local_path, self.install_path, symlinks=True)
+                # Only changed files are copied, so re-installing a package under development is cheap
+                with profiler.phase("copy", self.name) as info:
+                    info.update(fileops.sync_tree(self.local_path, self.install_path, self.exclude))
 
         else:
-            logging.info(f"Installing gh package {self}")
-
-            if not self.version:
-                self.version = "*"
-            self.version = self.fetch_tag(self.version)
-
-            if not upgrade:
-                if self.already_installed:
-                    return
-
-            zipball = self.fetch_data()
-
-            shutil.rmtree(self.zip_path, ignore_errors=True)
-            with ZipFile(BytesIO(zipball)) as archive:
-                archive.extractall(self.zip_path)
+            logging.info("Installing gh package %s", self)
+
+            commit = None
+            if not is_offline() and zipcache.entry(self.username, self.reponame, self.version) is None:
+                # Upgrades usually change a few files, so if another version is installed, only download those
+                with profiler.phase("delta", self.name) as info:
+                    commit = delta.install(self, info)
+
+            if commit is not None:
+                # There is no zipball to hash. Keep the locked one, or else record the hash of what was installed
+                self.commit = commit
+                if not self.sha256 or self.sha256.startswith(TREE_HASH_PREFIX):
+                    self.sha256 = self._tree_hash(self.sha256)
+            else:
+                self._install_zipball()
 
-            _, dirs, _ = next(self.zip_path.walk())
-            extraction_path = self.zip_path / dirs[0]
-            logging.info(f"Moving {extraction_path} to {self.install_path}")
+            # Versions of a package usually share most of their files, so store each file once
+            with profiler.phase("dedup", self.name) as info:
+                info.update(store.absorb(self.install_path))
 
+            self.local_path = self.install_path
+            self.invalidate()
+            self.resolve_metadata()
+
+        if not self.install_path.is_symlink():
+            # so that rebuilding the index (see index.rebuild) doesn't lose it
+            write_json(self.install_path / SOURCE_FILE, {"local": self.is_local, "commit": self.commit,
+                                                         "sha256": self.sha256})
+        index.add(self.install_path, str(self.username), self.reponame, self.version, self.commit, self.sha256)
+
+        echo(f"Installed {self.name} into {self.install_path}")
+        return True
+
+    def _install_zipball(self):
+        # Extract the zipball of this version into install_path, replacing whatever is there
+        with zipcache.zipball(self) as (zipball, sha256):
+            commit = top_level(zipball).rsplit('-', 1)[-1]
+            if self.commit and not (commit.startswith(self.commit) or self.commit.startswith(commit)):
+                raise ValueError(f"{self.name} is locked to commit {self.commit}, but the tag now points to "
+                                 f"{commit}. Was it moved?")
+            expected_tree = self.sha256 if self.sha256 and self.sha256.startswith(TREE_HASH_PREFIX) else None
+            if self.sha256 and not expected_tree and sha256 != self.sha256:
+                logging.warning("Zipball of %s has sha256 %s, but %s was expected. "
+                                "The commit matches, so GitHub probably regenerated the archive",
+                                self.name, sha256, self.sha256)
+            self.commit, self.sha256 = commit, sha256
+
+            index.remove(str(self.username), self.reponame, self.version)
             if self.install_path.is_symlink():
                 self.install_path.unlink()
             else:
                 rmtree(self.install_path, ignore_errors=True)
-            shutil.move(extraction_path, self.install_path)
-            rmtree(self.zip_path, ignore_errors=True)
 
-            self.local_path = self.install_path
-            self.resolve_toml_info()
+            with profiler.phase("extract", self.name):
+                extract_zipball(zipball, self.install_path)
 
-        print(f"Collected {self.deps}")
-        for dep in self.deps:
-            # Don't pass in editable.
-            dep.install(ids, upgrade=upgrade)
+        if expected_tree:
+            # locked after an upgrade by delta, so check the files instead
+            self._tree_hash(expected_tree)
 
-        print(f"Installed {self.name} into {self.install_path}")
+    def _tree_hash(self, expected: Optional[str] = None) -> str:
+        # Hash of the installed files, warning if it isn't the expected one
+        tree = tree_hash(self.install_path)
+        if expected and tree != expected:
+            logging.warning("Installed files of %s have hash %s, but %s was expected", self.name, tree, expected)
+        return tree
 
     def resolve(self) -> Self:
         pkgs = search_for_package(self.username, self.reponame, self.version)
         if len(pkgs) > 1:
-            logging.info(f"Multiple packages resolved for {self}\n\t{pkgs}")
+            logging.info("Multiple packages resolved for %s\n\t%s", self, pkgs)
         elif len(pkgs) == 0:
-            logging.warning(f"Could not resolve {self}")
+            logging.warning("Could not resolve %s", self)
             return self
 
         pkg = pkgs[0]
@@ -292,23 +479,43 @@ class Package:
         if not self.local_path:
             self.local_path = pkg.local_path
 
-        logging.info(f"Resolved {self=}")
-        self.resolve_toml_info()
+        logging.info("Resolved self=%r", self)
+        # deps are re-parsed from the resolved location when they are next needed
+        self.invalidate()
+        if self.local_path == pkg.local_path:
+            # share the memoized package's tomls, so that each is only read once
+            self._tomls = pkg._tomls
+        self.resolve_metadata()
 
         return self
 
+    @property
+    def exclude(self) -> list[str]:
+        """
+        Patterns of files to leave out when installing, from the `exclude` list in inflator.toml.
+        See fileops.DEFAULT_IGNORE for the syntax
+        """
+        return (self.load_toml("inflator") or {}).get("exclude", [])
+
     @property
     def symlink_folder(self):
         return "backpack" if self.backpack_only else "inflator"
 
 
+def _best(names: Iterable[str], pattern: str, prefer: Iterable[str]) -> Optional[str]:
+    # The newest tag matching pattern, preferring ones that also match everything in prefer
+    names = list(names)
+    return version.best([n for n in names if all(version.matches(n, p) for p in prefer)], pattern) \
+        or version.best(names, pattern)
+
+
 def search_for_package(usernames: Optional[list[str] | str] = None,
                        reponames: Optional[list[str] | str] = None,
                        versions: Optional[list[str] | str] = None,
                        globbed: bool = True):
     """
-    Find all repos that fit the query. Uses globs unless specified otherwise
-    :return: list[str] - list of string in format {username}\\{reponame}\\{version}
+    Find all installed packages that fit the query, using the package index. Uses globs unless specified otherwise
+    :return: list[Package] - dependencies are not resolved
     """
 
     def handle_l(ls):
@@ -324,47 +531,199 @@ def search_for_package(usernames: Optional[list[str] | str] = None,
     versions = handle_l(versions)
     usernames = [u.lower() for u in handle_l(usernames)]
 
-    logging.info(f"Searching for {reponames!r} {versions} by {usernames!r}")
-    try:
-        _, local_usernames, _ = next(APPDATA_FARETEK_PKGS.walk())
+    key = (tuple(usernames), tuple(reponames), tuple(versions), globbed, index.generation())
 
-        results = []
+    with _search_memo_lock:
+        if key in _search_memo:
+            memo_stats["hits"] += 1
+            return list(_search_memo[key])
+        memo_stats["misses"] += 1
 
-        def match_l(pats, value):
-            if globbed:
-                return not pats or any(fnmatch.fnmatch(value, p) for p in pats)
-            else:
-                return not pats or value in pats
+    logging.info("Searching for %r %s by %r", reponames, versions, usernames)
+
+    results = [Package.from_index(item) for item in index.query(usernames, reponames, versions, globbed)]
+    logging.info("Got %d packages", len(results))
 
-        for username in filter(lambda i: match_l(usernames, i.lower()), local_usernames):
-            logging.info(f"\tSearching for {username=}")
-            path1 = APPDATA_FARETEK_PKGS / username
-            _, local_reponames, _ = next(path1.walk())
+    with _search_memo_lock:
+        _search_memo[key] = results
 
-            for reponame in filter(lambda i: match_l(reponames, i.lower()), local_reponames):
-                logging.info(f"\tSearching for {reponame=}")
+    return list(results)
 
-                path2 = path1 / reponame
-                _, local_versions, possible_symlinks = next(path2.walk())
 
-                local_versions += [s for s in possible_symlinks if (path2 / s).is_symlink()]
+def install_packages(pkgs: list[Package], *, ids: Optional[list[str]] = None, editable: bool = False,
+                     upgrade: bool = False, jobs: int = 1, recursive: bool = True) -> dict[str, Package]:
+    """
+    Install packages and all of their dependencies, using up to `jobs` worker threads.
+    The graph is installed one level at a time, with the packages of each level fetched concurrently. Each package id
+    is only installed once per call, and a version that is already part of the graph is used for any other dependent
+    whose spec it satisfies. The specs for a repo at one level are resolved together.
+    Specs found deeper in the graph can exclude a version chosen earlier. If that leaves a repo with several versions
+    but one tag satisfies all of its specs, the graph is walked again with that tag, until every repo that can have one
+    version does.
+    Cycles are found once the whole graph is known, in one pass over it (see graph.DependencyGraph.cycles).
+    :param ids: ids of packages which are already being installed further up, and so cannot be depended upon
+    :param editable: only applies to `pkgs`, not their dependencies
+    :param recursive: whether to install dependencies. If not, pkgs should already have resolved versions
+    :return: every package in the resolved graph, by id. Their versions are resolved, and walking
+    `nodes[dep.id]` for each dep gives the whole graph
+    :raises OfflineError: when offline, after installing everything else that could be, listing everything that
+    would have needed the network. Dependencies of missing packages can't be known, so aren't listed
+    :raises graph.CycleError: with the full path of each cycle
+    """
+    # the tag each repo must use if its spec allows, once an earlier walk found that all of its specs share it
+    pins: dict[tuple[str, str], str] = {}
+    tried: set[tuple[tuple[str, str], str]] = set()
+    # ids installed by an earlier walk, which aren't installed again even when upgrading
+    installed: set[str] = set()
+
+    with index.batch():
+        while True:
+            walk = _Walk(pins, installed, ids, upgrade, jobs, recursive)
+            nodes = walk.run(pkgs, editable)
+            installed.update(nodes)
 
-                # Make newer versions come first.
-                # Because v1.0.0 is before v0.0.0 in alphabetical order, we can just do a reverse string list sort
-                local_versions.sort(reverse=True)
+            repins = {repo: tag for repo, tag in walk.shared_versions().items() if (repo, tag) not in tried}
+            if not repins:
+                break
+            logging.info("Walking the graph again with %s", repins)
+            pins.update(repins)
+            tried.update(repins.items())
 
-                for version in filter(lambda i: match_l(versions, i.lower()), local_versions):
-                    logging.info(f"\tSearching for {version=}")
+    if walk.missing:
+        raise OfflineError(sorted(set(walk.missing)))
 
-                    install_path = path2 / version
-                    pkg = Package.from_raw(install_path, username=username, reponame=reponame, version=version)
-                    results.append(pkg)
+    if recursive:
+        graph.DependencyGraph.from_installed(pkgs, nodes).check()
 
-                    logging.info(f"\tGot {pkg}")
-        return results
-    except StopIteration as e:
-        logging.info(f"Caught exception {e}")
-        logging.info("Making appdata dirs because they don't seem to exist")
+    return nodes
 
-        os.makedirs(APPDATA_FARETEK_PKGS)
-        return []
+
+class _Walk:
+    """
+    One breadth-first walk of the dependency graph for install_packages, installing what it reaches
+    """
+    def __init__(self, pins: dict[tuple[str, str], str], installed: set[str], ids: Optional[list[str]],
+                 upgrade: bool, jobs: int, recursive: bool):
+        self.pins = pins
+        self.installed = installed
+        self.blocked = frozenset(ids or ())
+        self.upgrade = upgrade
+        self.jobs = jobs
+        self.recursive = recursive
+
+        self.nodes: dict[str, Package] = {}
+        self.missing: list[str] = []
+        # versions of each (username, reponame) chosen so far, the specs they were chosen for, and one package of it
+        self.selected: dict[tuple[str, str], set[str]] = {}
+        self.specs: dict[tuple[str, str], set[str]] = {}
+        self.repos: dict[tuple[str, str], Package] = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def repo_of(pkg: Package) -> tuple[str, str]:
+        return str(pkg.username).lower(), pkg.reponame.lower()
+
+    def run(self, pkgs: list[Package], editable: bool) -> dict[str, Package]:
+        with ThreadPoolExecutor(max_workers=max(self.jobs, 1)) as pool:
+            wave, _editable = pkgs, editable
+            try:
+                # One level of the graph at a time, so that every spec for a repo at that level is known before any
+                # of them is resolved
+                while wave:
+                    self.prepare(wave)
+                    futures = [pool.submit(self.install_one, pkg, _editable) for pkg in wave]
+                    wave = [dep for future in futures for dep in future.result()]
+                    # Don't pass in editable.
+                    _editable = False
+            except BaseException:
+                pool.shutdown(cancel_futures=True)
+                raise
+
+        return self.nodes
+
+    def prepare(self, wave: list[Package]):
+        for pkg in wave:
+            if pkg.spec is None:
+                pkg.spec = pkg.version or "*"
+
+        # Fetch the tags of every package in a wave with as few requests as possible, before they are resolved
+        if self.recursive:
+            tags.prefetch((pkg.username, pkg.reponame) for pkg in wave
+                          if not pkg.is_local and not version.is_exact(pkg.spec))
+
+        # Every spec for a repo in the wave is known before any of them is resolved, so each is resolved against
+        # all the others and the versions chosen don't depend on which package of the wave is resolved first
+        with self.lock:
+            for pkg in wave:
+                if not pkg.is_local:
+                    self.specs.setdefault(self.repo_of(pkg), set()).add(pkg.spec)
+                    self.repos.setdefault(self.repo_of(pkg), pkg)
+
+    def install_one(self, pkg: Package, _editable: bool) -> list[Package]:
+        try:
+            return self._install_one(pkg, _editable)
+        except OfflineError as e:
+            with self.lock:
+                self.missing.extend(e.missing)
+            return []
+
+    def _install_one(self, pkg: Package, _editable: bool) -> list[Package]:
+        repo = self.repo_of(pkg)
+        pkg.version = pkg.spec
+        pinned = self.pins.get(repo)
+
+        # Reuse a version of the same repo that is already in the graph if the spec allows it,
+        # so that compatible dependents share one download and one installation
+        with self.lock:
+            if pkg.is_local:
+                chosen = None
+            elif pinned is not None and version.matches(pinned, pkg.spec):
+                chosen = pinned
+            else:
+                chosen = version.best(self.selected.get(repo, ()), pkg.spec)
+            # Otherwise pick a version that other dependents could share too
+            self.specs.setdefault(repo, set()).add(pkg.spec)
+            others = list(self.specs[repo])
+
+        if chosen is not None:
+            logging.info("Reusing %s of %s/%s for %r", chosen, pkg.username, pkg.reponame, pkg.spec)
+            pkg.version = chosen
+        else:
+            pkg.resolve_version(others)
+        if not pkg.is_local:
+            with self.lock:
+                self.selected.setdefault(repo, set()).add(pkg.version)
+
+        if pkg.id in self.blocked:
+            raise graph.CycleError([[pkg, pkg]])
+
+        with self.lock:
+            if pkg.id in self.nodes:
+                return []
+            self.nodes[pkg.id] = pkg
+
+        pkg.install_self(editable=_editable, upgrade=self.upgrade and pkg.id not in self.installed)
+
+        if not self.recursive:
+            return []
+
+        echo(f"Collected {pkg.deps}")
+        return pkg.deps
+
+    def shared_versions(self) -> dict[tuple[str, str], str]:
+        """
+        For each repo that ended up with more than one version, the newest tag that satisfies all of its specs, if any
+        """
+        ret = {}
+        for repo, versions in self.selected.items():
+            if len(versions) < 2:
+                continue
+
+            first, *others = sorted(self.specs[repo])
+            try:
+                tag = self.repos[repo].fetch_tag(first, others)
+            except (ValueError, OfflineError):
+                continue
+            if all(version.matches(tag, spec) for spec in self.specs[repo]):
+                ret[repo] = tag
+        return ret
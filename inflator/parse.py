@@ -19,9 +19,12 @@ class IFToml:
     deps: list[package.Package] = field(default_factory=list)
 
 
-def parse_gstoml(toml: dict, _id: Optional[str] = None):
-    logging.info(f"Parsing gstoml {toml}")
-    deps = []
+def gstoml_deps(toml: dict) -> list[dict[str, Optional[str]]]:
+    """
+    Read the dependencies of a goboscript.toml without resolving them.
+    :return: list of {"importname", "raw", "version", "username"}
+    """
+    specs = []
 
     for name, src in toml.get("dependencies", {}).items():
         split = src.split("==")
@@ -34,14 +37,17 @@ def parse_gstoml(toml: dict, _id: Optional[str] = None):
             version = split[-1]
             url = '@'.join(split[:-1])
 
-        deps.append(package.Package.from_raw(url, version=version, importname=name))
+        specs.append({"importname": name, "raw": url, "version": version, "username": None})
 
-    return IFToml(deps=deps)
+    return specs
 
 
-def parse_iftoml(toml: dict, _id: Optional[str] = None):
-    logging.info(f"Parsing iftoml {toml}")
-    deps = []
+def iftoml_deps(toml: dict) -> list[dict[str, Optional[str]]]:
+    """
+    Read the dependencies of an inflator.toml without resolving them.
+    :return: list of {"importname", "raw", "version", "username"}
+    """
+    specs = []
     tdeps = toml.get("dependencies", {})
 
     for name, value in tdeps.items():
@@ -60,9 +66,24 @@ def parse_iftoml(toml: dict, _id: Optional[str] = None):
             else:
                 raise ValueError(f"Unexpected {value=}")
 
-        deps.append(
-            package.Package.from_raw(raw, version=version, importname=name, _id=_id, username=username)
-        )
+        specs.append({"importname": name, "raw": raw, "version": version, "username": username})
+
+    return specs
+
+
+def parse_gstoml(toml: dict, _id: Optional[str] = None):
+    logging.info("Parsing gstoml %s", toml)
+    deps = [package.Package.from_raw(spec["raw"], version=spec["version"], importname=spec["importname"])
+            for spec in gstoml_deps(toml)]
+
+    return IFToml(deps=deps)
+
+
+def parse_iftoml(toml: dict, _id: Optional[str] = None):
+    logging.info("Parsing iftoml %s", toml)
+    deps = [package.Package.from_raw(spec["raw"], version=spec["version"], importname=spec["importname"], _id=_id,
+                                     username=spec["username"])
+            for spec in iftoml_deps(toml)]
 
     return IFToml(
         username=toml.get("username"),
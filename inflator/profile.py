@@ -0,0 +1,112 @@
+# Per-phase timing of a run, for `inflate --profile` and `inflate --trace`. Does nothing unless enabled
+from __future__ import annotations
+
+import json
+import os
+import pathlib
+import threading
+import time
+
+from collections import defaultdict
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Iterator, Optional
+
+
+@dataclass
+class Event:
+    phase: str
+    package: Optional[str]
+    start: float
+    end: float
+    thread: int
+    # e.g. {"bytes": ...}, filled in by the code being timed
+    info: dict[str, Any] = field(default_factory=dict)
+
+    @property
+    def duration(self):
+        return self.end - self.start
+
+
+class Profiler:
+    def __init__(self):
+        self.enabled = False
+        self.events: list[Event] = []
+        self._lock = threading.Lock()
+        self._origin = time.perf_counter()
+
+    def enable(self):
+        self.enabled = True
+        self._origin = time.perf_counter()
+
+    @contextmanager
+    def phase(self, name: str, package: Optional[str] = None) -> Iterator[dict[str, Any]]:
+        """
+        Time the with block as one occurrence of a phase. Yields a dict that counters such as "bytes" can be added to
+        """
+        info = {}
+        if not self.enabled:
+            yield info
+            return
+
+        start = time.perf_counter()
+        try:
+            yield info
+        finally:
+            event = Event(name, package, start, time.perf_counter(), threading.get_ident(), info)
+            with self._lock:
+                self.events.append(event)
+
+    def summary(self, top: int = 10) -> str:
+        """
+        Table of the total time of each phase, then of the packages that took the longest
+        """
+        phases = defaultdict(list)
+        packages = defaultdict(float)
+        for event in self.events:
+            phases[event.phase].append(event)
+            if event.package:
+                packages[event.package] += event.duration
+
+        lines = [f"{'phase':<12} {'count':>6} {'total ms':>10} {'mean ms':>9} {'max ms':>9}  extra"]
+        for phase, events in sorted(phases.items(), key=lambda i: -sum(e.duration for e in i[1])):
+            durations = [e.duration * 1000 for e in events]
+
+            extra = defaultdict(int)
+            for event in events:
+                for key, value in event.info.items():
+                    extra[key] += value
+
+            lines.append(f"{phase:<12} {len(events):>6} {sum(durations):>10.1f} {sum(durations) / len(durations):>9.1f} "
+                         f"{max(durations):>9.1f}  {', '.join(f'{k}={v}' for k, v in extra.items())}")
+
+        if packages:
+            lines += ["", f"{'package':<50} {'total ms':>10}"]
+            for package, duration in sorted(packages.items(), key=lambda i: -i[1])[:top]:
+                lines.append(f"{package:<50} {duration * 1000:>10.1f}")
+
+        lines += ["", f"wall time: {(time.perf_counter() - self._origin) * 1000:.1f} ms "
+                      "(phases overlap when installing with multiple jobs)"]
+        return '\n'.join(lines)
+
+    def write_trace(self, path: pathlib.Path):
+        """
+        Write the events in Chrome's trace event format. Open it with chrome://tracing or https://ui.perfetto.dev
+        """
+        pid = os.getpid()
+        trace = [{
+            "name": f"{event.phase} {event.package}" if event.package else event.phase,
+            "cat": event.phase,
+            "ph": "X",
+            "ts": (event.start - self._origin) * 1e6,
+            "dur": event.duration * 1e6,
+            "pid": pid,
+            "tid": event.thread,
+            "args": event.info,
+        } for event in self.events]
+
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": trace, "displayTimeUnit": "ms"}, f)
+
+
+profiler = Profiler()
@@ -0,0 +1,450 @@
+# `inflate serve`: a caching proxy in front of the GitHub API, so that a team or a CI fleet downloads each tag once.
+# Point clients at it with `inflate set github-api http://<host>:<port>`.
+# Requests go upstream with the client's own credential, never with this machine's auth-token, and responses that
+# depend on who is asking are cached per credential. Only the endpoints that inflator uses are served
+from __future__ import annotations
+
+import base64
+import hashlib
+import json
+import logging
+import os
+import pathlib
+import re
+import shutil
+import tempfile
+import threading
+import time
+
+from collections import Counter
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Optional, TypeVar
+from urllib.parse import urlsplit
+
+from inflator import gtp, net, zipcache
+from inflator.cookies import cookies
+from inflator.net import GITHUB_API
+from inflator.util import APPDATA_FARETEK_CACHE, CHUNK_SIZE, file_hash, read_json, write_json
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+# Seconds before a cached tag list or gtp.json is revalidated upstream. Revalidations that come back 304 don't count
+# against the rate limit. Configure with `inflate set serve-ttl <seconds>`
+DEFAULT_TTL = 60
+# Tag archives and blobs never change, so clients may keep them for a year. Not shared caches, since they may be private
+IMMUTABLE = "private, max-age=31536000, immutable"
+
+TAGS_RE = re.compile(r"/repos/([^/]+)/([^/]+)/tags")
+ZIPBALL_RE = re.compile(r"/repos/([^/]+)/([^/]+)/zipball/refs/tags/(.+)")
+BLOB_RE = re.compile(r"/repos/([^/]+)/([^/]+)/git/blobs/([0-9a-f]{40})")
+COMPARE_RE = re.compile(r"/repos/([^/]+)/([^/]+)/compare/(.+)\.\.\.(.+)")
+GTP_PATH = f"/repos/{gtp.GTP_REPO}/contents/gtp.json"
+GRAPHQL_PATH = "/graphql"
+
+# Request headers passed on to GitHub for requests that aren't cached
+FORWARD_HEADERS = ("Accept", "Authorization", "Content-Type", "If-None-Match")
+# Largest GraphQL request body that is forwarded
+MAX_BODY = 1024 ** 2
+# Strings and comments of a GraphQL document, which may contain anything
+GRAPHQL_IGNORED_RE = re.compile(r'"""[\s\S]*?"""|"(?:[^"\\\n]|\\.)*"|#[^\n]*')
+GRAPHQL_WRITE_RE = re.compile(r"\b(mutation|subscription)\b")
+
+T = TypeVar("T")
+
+
+def _cache_dir() -> pathlib.Path:
+    return APPDATA_FARETEK_CACHE / "serve"
+
+
+def _digest(key: str) -> str:
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def ttl() -> float:
+    return float(cookies.get("serve-ttl", DEFAULT_TTL))
+
+
+def upstream_headers(auth: Optional[str], etag: Optional[str] = None,
+                     accept: str = "application/vnd.github+json") -> dict[str, str]:
+    """
+    Headers for a request made upstream on behalf of a client
+    :param auth: the client's Authorization header. Without one the request is anonymous
+    :param etag: see net.api_headers
+    """
+    headers = {"Accept": accept}
+    if auth:
+        headers["Authorization"] = auth
+    if etag:
+        headers["If-None-Match"] = etag
+    return headers
+
+
+def is_read_only(body: bytes) -> bool:
+    """
+    Whether a GraphQL request body only queries. Mutations and subscriptions, or anything that can't be parsed, aren't
+    """
+    try:
+        query = json.loads(body)["query"]
+    except (ValueError, KeyError, TypeError):
+        return False
+    return isinstance(query, str) and not GRAPHQL_WRITE_RE.search(GRAPHQL_IGNORED_RE.sub(" ", query))
+
+
+class SingleFlight:
+    """
+    Collapses concurrent calls with the same key into one: the first caller does the work, and everyone who asks for
+    the same key meanwhile gets its result (or exception)
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights: dict[str, Future] = {}
+        self.collapsed = 0
+
+    def do(self, key: str, fn: Callable[[], T]) -> T:
+        with self._lock:
+            future = self._flights.get(key)
+            leader = future is None
+            if leader:
+                future = self._flights[key] = Future()
+            else:
+                self.collapsed += 1
+
+        if not leader:
+            return future.result()
+
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._flights[key]
+
+
+class Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: tuple[str, int], upstream: str):
+        super().__init__(address, _Handler)
+        self.upstream = upstream.rstrip('/')
+        self.flights = SingleFlight()
+        # responses by how they were answered: "hit", "miss", "revalidated", "forwarded", "error"
+        self.stats: Counter[str] = Counter()
+        self._stats_lock = threading.Lock()
+
+    def count(self, kind: str):
+        with self._stats_lock:
+            self.stats[kind] += 1
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def api(self, path: str, auth: Optional[str]) -> dict[str, Any]:
+        """
+        Upstream response to a GET of path (with query string) as a dict, from the disk cache while it is younger than
+        ttl(), otherwise revalidated with its ETag. Cached separately for each credential
+        :param auth: the client's Authorization header
+        """
+        key = f"{_digest(auth) if auth else 'anonymous'} {path}"
+        cache_path = _cache_dir() / "api" / f"{_digest(key)}.json"
+        entry = read_json(cache_path)
+        if entry is not None and time.time() - entry["fetched"] < ttl():
+            self.count("hit")
+            return entry
+
+        def fetch():
+            resp = net.request("GET", self.upstream + path,
+                               headers=upstream_headers(auth, entry["etag"] if entry else None))
+            if resp.status_code == 304 and entry is not None:
+                self.count("revalidated")
+                entry["fetched"] = time.time()
+                write_json(cache_path, entry)
+                return entry
+
+            self.count("miss")
+            new = {
+                "status": resp.status_code,
+                "etag": resp.headers.get("ETag"),
+                "link": resp.headers.get("Link"),
+                "content_type": resp.headers.get("Content-Type", "application/json"),
+                "body": resp.text,
+                "fetched": time.time(),
+            }
+            if resp.status_code == 200:
+                write_json(cache_path, new)
+            return new
+
+        return self.flights.do(key, fetch)
+
+    def archive(self, username: str, reponame: str, tag: str,
+                auth: Optional[str]) -> Optional[tuple[pathlib.Path, str]]:
+        """
+        The zipball of a tag, from the zipball cache that installs on this machine use too. Archives too big for
+        that cache are kept separately, each with its sha256 next to it so that hits don't read the whole archive.
+        Only serve it to clients that can read the repo
+        :param auth: the client's Authorization header, used if it has to be downloaded
+        :return: path and sha256, or None if the tag doesn't exist
+        """
+        if (cached := zipcache.get(username, reponame, tag)) is not None:
+            self.count("hit")
+            return cached
+
+        oversize = _cache_dir() / "oversize" / f"{_digest(f'{username}/{reponame}/{tag}'.lower())}.zip"
+        oversize_hash = oversize.with_suffix(".sha256")
+        if oversize.exists():
+            self.count("hit")
+            try:
+                return oversize, oversize_hash.read_text()
+            except FileNotFoundError:
+                sha256 = file_hash(oversize)
+                oversize_hash.write_text(sha256)
+                return oversize, sha256
+
+        def fetch():
+            import httpx
+
+            self.count("miss")
+            oversize.parent.mkdir(parents=True, exist_ok=True)
+            fd, name = tempfile.mkstemp(prefix=".download-", suffix=".zip", dir=oversize.parent)
+            download = pathlib.Path(name)
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    net.download(f"{self.upstream}/repos/{username}/{reponame}/zipball/refs/tags/{tag}", f,
+                                 headers=upstream_headers(auth))
+            except httpx.HTTPStatusError as e:
+                download.unlink(missing_ok=True)
+                if e.response.status_code == 404:
+                    return None
+                raise
+            except BaseException:
+                download.unlink(missing_ok=True)
+                raise
+
+            sha256 = file_hash(download)
+            if (path := zipcache.put(username, reponame, tag, download, sha256)) is None:
+                # the hash first, so that it is there whenever the archive is
+                oversize_hash.write_text(sha256)
+                path = download.replace(oversize)
+            return path, sha256
+
+        return self.flights.do(f"zipball {username}/{reponame}/{tag}".lower(), fetch)
+
+    def blob(self, username: str, reponame: str, sha: str, auth: Optional[str]) -> Optional[pathlib.Path]:
+        """
+        A git blob, which is named by its own content so can be cached forever. Kept per repo, since it can only be
+        served to clients that can read the repo it came from
+        :param auth: the client's Authorization header, used if it has to be downloaded
+        :return: path to the raw content, or None if it doesn't exist
+        """
+        path = _cache_dir() / "blobs" / _digest(f"{username}/{reponame}".lower()) / sha
+        if path.exists():
+            self.count("hit")
+            return path
+
+        def fetch():
+            resp = net.request("GET", f"{self.upstream}/repos/{username}/{reponame}/git/blobs/{sha}",
+                               headers=upstream_headers(auth, accept="application/vnd.github.raw+json"))
+            self.count("miss")
+            if resp.status_code == 404:
+                return None
+            resp.raise_for_status()
+
+            path.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(prefix=".blob-", dir=path.parent)
+            with os.fdopen(fd, "wb") as f:
+                f.write(resp.content)
+            os.replace(tmp, path)
+            return path
+
+        return self.flights.do(f"blob {username}/{reponame}/{sha}".lower(), fetch)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: Server
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        logging.info("%s - %s", self.address_string(), format % args)
+
+    def _send(self, status: int, body: bytes = b"", headers: Optional[dict[str, Optional[str]]] = None):
+        self.send_response(status)
+        for key, value in {"Content-Type": "application/json", **(headers or {})}.items():
+            if value is not None:
+                self.send_header(key, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def _not_found(self):
+        self._send(404, b'{"message": "Not Found"}')
+
+    def _refuse(self):
+        # Everything that inflator doesn't need, so that the proxy can't be used to act on GitHub
+        self.server.count("refused")
+        self._send(404, b'{"message": "Not served by inflate serve"}')
+
+    @property
+    def _auth(self) -> Optional[str]:
+        return self.headers.get("Authorization")
+
+    def _can_read(self, username: str, reponame: str) -> bool:
+        # Archives and blobs are the same for everyone who can see the repo, so they are cached once, but only served
+        # to clients that GitHub shows the repo to. Otherwise GitHub's answer is sent
+        entry = self.server.api(f"/repos/{username}/{reponame}", self._auth)
+        if entry["status"] != 200:
+            self._send(entry["status"], entry["body"].encode(), {"Content-Type": entry["content_type"]})
+            return False
+        return True
+
+    def _not_modified(self, etag: Optional[str]) -> bool:
+        return etag is not None and self.headers.get("If-None-Match") == etag
+
+    def _own_url(self, link: Optional[str]) -> Optional[str]:
+        # pagination links point upstream, so that the next page would bypass the proxy
+        if link is None:
+            return None
+        return link.replace(self.server.upstream, f"http://{self.headers.get('Host', self.server.url[7:])}")
+
+    def do_GET(self):
+        import httpx
+
+        path = urlsplit(self.path).path
+        try:
+            if match := ZIPBALL_RE.fullmatch(path):
+                return self._send_archive(*match.groups())
+            if match := BLOB_RE.fullmatch(path):
+                return self._send_blob(*match.groups())
+            if TAGS_RE.fullmatch(path) or path == GTP_PATH:
+                return self._send_api()
+            if COMPARE_RE.fullmatch(path):
+                return self._forward()
+            return self._refuse()
+
+        except httpx.HTTPError as e:
+            logging.warning("Upstream error for %s: %r", self.path, e)
+            self.server.count("error")
+            self._send(502, json.dumps({"message": f"Upstream error: {e}"}).encode())
+
+    do_HEAD = do_GET
+
+    def do_POST(self):
+        import httpx
+
+        length = int(self.headers.get("Content-Length", 0))
+        if urlsplit(self.path).path != GRAPHQL_PATH or length > MAX_BODY:
+            self.close_connection = True
+            return self._refuse()
+
+        body = self.rfile.read(length)
+        if not is_read_only(body):
+            return self._refuse()
+
+        try:
+            self._forward(body)
+        except httpx.HTTPError as e:
+            logging.warning("Upstream error for %s: %r", self.path, e)
+            self.server.count("error")
+            self._send(502, json.dumps({"message": f"Upstream error: {e}"}).encode())
+
+    def _send_api(self):
+        entry = self.server.api(self.path, self._auth)
+        if self._not_modified(entry["etag"]):
+            return self._send(304, headers={"ETag": entry["etag"]})
+
+        self._send(entry["status"], entry["body"].encode(), {
+            "Content-Type": entry["content_type"],
+            "ETag": entry["etag"],
+            "Link": self._own_url(entry["link"]),
+            "Cache-Control": "no-cache",
+        })
+
+    def _send_archive(self, username: str, reponame: str, tag: str):
+        if not self._can_read(username, reponame):
+            return
+
+        found = self.server.archive(username, reponame, tag, self._auth)
+        if found is None:
+            return self._not_found()
+
+        path, sha256 = found
+        etag = f'"{sha256}"'
+        headers = {"ETag": etag, "Cache-Control": IMMUTABLE}
+        if self._not_modified(etag):
+            return self._send(304, headers=headers)
+
+        # Opened before anything is sent, so that the cache can evict it meanwhile without breaking the response
+        with open(path, "rb") as f:
+            self.send_response(200)
+            for key, value in {"Content-Type": "application/zip", **headers,
+                               "Content-Length": str(os.fstat(f.fileno()).st_size),
+                               "Content-Disposition": f"attachment; filename={reponame}-{tag}.zip"}.items():
+                self.send_header(key, value)
+            self.end_headers()
+            if self.command != "HEAD":
+                shutil.copyfileobj(f, self.wfile, CHUNK_SIZE)
+
+    def _send_blob(self, username: str, reponame: str, sha: str):
+        if not self._can_read(username, reponame):
+            return
+
+        path = self.server.blob(username, reponame, sha, self._auth)
+        if path is None:
+            return self._not_found()
+
+        etag = f'"{sha}"'
+        headers = {"ETag": etag, "Cache-Control": IMMUTABLE}
+        if self._not_modified(etag):
+            return self._send(304, headers=headers)
+
+        content = path.read_bytes()
+        if "raw" in self.headers.get("Accept", ""):
+            return self._send(200, content, {**headers, "Content-Type": "application/vnd.github.raw"})
+        self._send(200, json.dumps({"sha": sha, "size": len(content), "encoding": "base64",
+                                    "content": base64.b64encode(content).decode()}).encode(), headers)
+
+    def _forward(self, body: Optional[bytes] = None):
+        # Compares and GraphQL queries are passed through uncached, with only the client's own credential
+        headers = upstream_headers(None)
+        headers.update({key: self.headers[key] for key in FORWARD_HEADERS if key in self.headers})
+
+        resp = net.request(self.command, self.server.upstream + self.path, headers=headers, content=body)
+        self.server.count("forwarded")
+        self._send(resp.status_code, resp.content, {
+            "Content-Type": resp.headers.get("Content-Type"),
+            "ETag": resp.headers.get("ETag"),
+            "Link": self._own_url(resp.headers.get("Link")),
+        })
+
+
+def upstream() -> str:
+    """
+    What `inflate serve` fronts. Configure with `inflate set serve-upstream <url>`. Not the github-api cookie, since
+    on a machine that uses its own proxy that would point back at itself
+    """
+    return str(cookies.get("serve-upstream") or GITHUB_API)
+
+
+def serve(host: str = DEFAULT_HOST, port: int = DEFAULT_PORT, upstream_url: Optional[str] = None):
+    """
+    Run the proxy until interrupted
+    """
+    server = Server((host, port), upstream_url or upstream())
+    print(f"Serving {server.upstream} on {server.url}\n"
+          f"Use it with `inflate set github-api {server.url}`", flush=True)
+    logging.info("Serving %s on %s", server.upstream, server.url)
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"Stopped. {dict(server.stats)}, {server.flights.collapsed} requests collapsed")
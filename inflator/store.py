@@ -0,0 +1,181 @@
+# Content-addressed blob store. Files of gh packages are stored once by sha256, and every installed version is made of
+# hardlinks into it, so versions that share files share disk space
+from __future__ import annotations
+
+import logging
+import os
+import pathlib
+import stat
+
+from collections import Counter
+from dataclasses import dataclass
+
+from inflator import index
+from inflator.util import APPDATA_FARETEK_PKGS, APPDATA_FARETEK_STORE, SOURCE_FILE, file_hash
+
+
+def blob_path(sha256: str) -> pathlib.Path:
+    return APPDATA_FARETEK_STORE / sha256[:2] / sha256[2:]
+
+
+def refcount(blob: pathlib.Path) -> int:
+    """
+    Number of installed files using a blob. The filesystem already counts hardlinks, so the count can never drift from
+    what is actually installed, even if a package folder is deleted by hand
+    """
+    return blob.stat().st_nlink - 1
+
+
+def _link(src: pathlib.Path, dst: pathlib.Path):
+    # Swap dst for a hardlink to src, without a moment where dst doesn't exist
+    tmp = dst.with_name(f".{dst.name}.inflator-tmp")
+    tmp.unlink(missing_ok=True)
+    os.link(src, tmp)
+    os.replace(tmp, dst)
+
+
+def absorb(path: pathlib.Path) -> Counter[str]:
+    """
+    Move the files of an installed package into the store, replacing each with a hardlink to its blob.
+    Blobs are read-only, because writing to an installed file would change every version that shares it.
+    If the store is on another filesystem, files are left as they are
+    :return: number of files "stored" as new blobs, "deduplicated" against existing ones, or "skipped"
+    """
+    stats = Counter()
+
+    for root, dirs, files in path.walk():
+        for name in files:
+            if name == SOURCE_FILE:
+                continue
+
+            file = root / name
+            st = file.lstat()
+            if not stat.S_ISREG(st.st_mode):
+                stats["skipped"] += 1
+                continue
+
+            blob = blob_path(file_hash(file))
+            if blob.exists():
+                if (st.st_dev, st.st_ino) != ((bst := blob.stat()).st_dev, bst.st_ino):
+                    try:
+                        _link(blob, file)
+                    except OSError as e:
+                        logging.info("Can't link %s to the store (%s)", file, e)
+                        stats["skipped"] += 1
+                        continue
+                stats["deduplicated"] += 1
+                continue
+
+            blob.parent.mkdir(parents=True, exist_ok=True)
+            os.chmod(file, stat.S_IMODE(st.st_mode) & ~(stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH))
+            try:
+                os.link(file, blob)
+            except FileExistsError:
+                # another install stored the same content first
+                _link(blob, file)
+                stats["deduplicated"] += 1
+            except OSError as e:
+                logging.info("Can't link %s to the store (%s)", file, e)
+                stats["skipped"] += 1
+            else:
+                stats["stored"] += 1
+
+    logging.info("Absorbed %s into the store: %s", path, dict(stats))
+    return stats
+
+
+def _blobs():
+    if not APPDATA_FARETEK_STORE.exists():
+        return
+    for folder in APPDATA_FARETEK_STORE.iterdir():
+        if folder.is_dir():
+            yield from (blob for blob in folder.iterdir() if not blob.name.startswith('.'))
+
+
+def gc() -> tuple[int, int]:
+    """
+    Delete blobs that no installed file uses any more
+    :return: number of blobs and bytes freed
+    """
+    count = size = 0
+    for blob in _blobs():
+        st = blob.stat()
+        if st.st_nlink <= 1:
+            blob.unlink()
+            count += 1
+            size += st.st_size
+
+    logging.info("Store gc freed %d blobs, %d bytes", count, size)
+    return count, size
+
+
+def _unlinked(path: pathlib.Path) -> bool:
+    # Whether no file of path is a hardlink
+    return all((root / name).lstat().st_nlink == 1 for root, dirs, files in path.walk() for name in files)
+
+
+def migrate() -> Counter[str]:
+    """
+    Absorb every gh package installed before the store existed. Local packages are left alone, since their files may
+    be hardlinks to the package's source. Packages that don't say where they came from (installed before SOURCE_FILE
+    was written) are absorbed if none of their files are hardlinked anywhere, as local packages were plain copies then
+    """
+    stats = Counter()
+    for item in index.query([], [], []):
+        path = pathlib.Path(item["path"])
+        if path.is_symlink() or item.get("local"):
+            continue
+        if item.get("local") is None and not item.get("commit") and not _unlinked(path):
+            continue
+
+        stats.update(absorb(path))
+        stats["packages"] += 1
+    return stats
+
+
+@dataclass
+class Stats:
+    blobs: int = 0
+    blob_bytes: int = 0
+    # blobs that nothing uses, which `inflate store gc` would delete
+    unused_blobs: int = 0
+    references: int = 0
+
+    # every file in the package store, counting each hardlink separately
+    files: int = 0
+    logical_bytes: int = 0
+    # bytes actually taken up on disk by the package store and the blob store
+    physical_bytes: int = 0
+
+    @property
+    def dedup_ratio(self) -> float:
+        return self.logical_bytes / self.physical_bytes if self.physical_bytes else 1.0
+
+
+def stats() -> Stats:
+    ret = Stats()
+    inodes = set()
+
+    for blob in _blobs():
+        st = blob.stat()
+        ret.blobs += 1
+        ret.blob_bytes += st.st_size
+        ret.references += st.st_nlink - 1
+        ret.unused_blobs += st.st_nlink <= 1
+        inodes.add((st.st_dev, st.st_ino))
+        ret.physical_bytes += st.st_size
+
+    if APPDATA_FARETEK_PKGS.exists():
+        for root, dirs, files in APPDATA_FARETEK_PKGS.walk():
+            for name in files:
+                st = (root / name).lstat()
+                if not stat.S_ISREG(st.st_mode):
+                    continue
+
+                ret.files += 1
+                ret.logical_bytes += st.st_size
+                if (st.st_dev, st.st_ino) not in inodes:
+                    inodes.add((st.st_dev, st.st_ino))
+                    ret.physical_bytes += st.st_size
+
+    return ret
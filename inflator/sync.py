@@ -5,44 +5,114 @@ import pathlib
 import shutil
 import os
 
-from inflator import package
+from collections import Counter
+
+from inflator import graph, lock, package
+from inflator.profile import profiler
 
 
 def sync(path: pathlib.Path):
-    logging.info(f"Collecting packages in {path}")
-    pkg = package.Package.from_raw(str(path))
+    dependencies = dependency_graph(path)
+    if cycles := dependencies.cycles():
+        # Still linkable, since every package is only linked once. goboscript will complain if it matters
+        logging.warning(str(graph.CycleError(cycles)))
 
-    def collect(_pkg: package.Package, *, toplevel=False):
-        # Don't include the original directory, because that isn't a package - just something using them
-        ret = [] if toplevel else [_pkg]
-        for dep in _pkg.deps:
-            dep.resolve()
-            ret += collect(dep)
+    deps = dependencies.links()
+    print("Collected:{}"
+          .format(''.join(f"\n- {dep.name}" for dep in deps) if deps else " nothing"))
 
-        return ret
+    link(path, deps)
 
-    deps = collect(pkg, toplevel=True)
 
-    print("Collected:{}"
-          .format(''.join(f"\n- {dep.name}" for dep in deps) if deps else " nothing"))
+def dependency_graph(path: pathlib.Path) -> graph.DependencyGraph:
+    """
+    Graph of every package used by the project at path: from its inflator.lock if that is up to date, else resolved
+    against the installed packages
+    """
+    locked = lock.read(path)
+    if locked is not None and lock.is_fresh(locked, path):
+        logging.info("Using %s in %s", lock.LOCK_NAME, path)
+        return graph.DependencyGraph.from_lock(locked)
+    return graph.DependencyGraph.from_project(path)
+
+
+def _prune(folder: pathlib.Path, desired: dict[pathlib.Path, pathlib.Path], parents: set[pathlib.Path]) -> int:
+    # Remove everything in folder that isn't a wanted symlink, or a folder containing one
+    removed = 0
+
+    for entry in folder.iterdir():
+        if entry in desired:
+            continue
+
+        if entry.is_dir() and not entry.is_symlink():
+            if entry in parents:
+                removed += _prune(entry, desired, parents)
+                continue
+            shutil.rmtree(entry)
+        else:
+            entry.unlink()
 
-    if not deps:
-        print("Nothing to sync, so nothing to do")
-        return
+        logging.info("Removed %s", entry)
+        removed += 1
 
-    (path / "backpack").mkdir(exist_ok=True)
-    (path / "inflator").mkdir(exist_ok=True)
+    return removed
 
-    shutil.rmtree(path / "backpack", ignore_errors=True)
-    shutil.rmtree(path / "inflator", ignore_errors=True)
 
+def _symlink_atomic(sympath: pathlib.Path, target: pathlib.Path):
+    # Make the new link under a temporary name, then rename it over the old one, so sympath always exists
+    tmp = sympath.with_name(f".{sympath.name}.{os.getpid()}.tmp")
+    tmp.unlink(missing_ok=True)
+    tmp.symlink_to(target, target_is_directory=True)
+
+    try:
+        os.replace(tmp, sympath)
+    except OSError:
+        # Windows can't rename over a directory symlink
+        sympath.unlink()
+        os.replace(tmp, sympath)
+
+
+def link(path: pathlib.Path, deps: list[package.Package]):
+    """
+    Make backpack/ and inflator/ contain exactly one symlink per dependency. Only links that are missing or point
+    somewhere else are touched, so the project stays usable while this runs.
+    If two deps want the same link, the first one wins, so list them shallowest first (see DependencyGraph.links)
+    """
+    desired: dict[pathlib.Path, pathlib.Path] = {}
     for dep in deps:
+        assert dep.install_path.exists()  # You haven't installed the dependency, or you may have spelt something wrong.
         sympath = path / dep.symlink_folder / dep.importname
+        if sympath not in desired:
+            desired[sympath] = dep.install_path
+        elif desired[sympath] != dep.install_path:
+            logging.warning("%s would link to both %s and %s. Keeping the first, which is nearer the project",
+                            sympath.relative_to(path), desired[sympath], dep.install_path)
 
-        logging.info(f"Symlinking {sympath} into {dep.install_path}")
+    parents = {parent for sympath in desired for parent in sympath.parents}
+    counts = Counter()
 
-        assert dep.install_path.exists()  # You haven't installed the dependency, or you may have spelt something wrong.
+    with profiler.phase("symlink"):
+        for folder in ("backpack", "inflator"):
+            if (path / folder).is_dir():
+                counts["removed"] += _prune(path / folder, desired, parents)
+
+        for sympath, target in desired.items():
+            if sympath.is_symlink():
+                if pathlib.Path(os.readlink(sympath)) == target:
+                    counts["unchanged"] += 1
+                    continue
+                counts["updated"] += 1
+            elif sympath.exists():
+                # a real folder where the link should be
+                shutil.rmtree(sympath)
+                counts["updated"] += 1
+            else:
+                counts["created"] += 1
+
+            logging.info("Symlinking %s into %s", sympath, target)
+
+            os.makedirs(sympath.parent, exist_ok=True)
+            _symlink_atomic(sympath, target)
 
-        os.makedirs(pathlib.Path(*sympath.parts[:-1]), exist_ok=True)
-        sympath.unlink(missing_ok=True)
-        sympath.symlink_to(dep.install_path, target_is_directory=True)
+    print("Synced: {created} created, {updated} updated, {removed} removed, {unchanged} unchanged"
+          .format_map(counts))
@@ -0,0 +1,192 @@
+# Cache of the tags of GitHub repos, revalidated with ETags once the TTL runs out
+from __future__ import annotations
+
+import json
+import logging
+import threading
+import time
+
+from typing import Any, Iterable, Optional
+
+from inflator.cookies import cookies
+from inflator.net import api_base, api_headers, ensure_online, is_offline, request
+from inflator.profile import profiler
+from inflator.util import APPDATA_FARETEK_CACHE, read_json, write_json
+
+# Configure with `inflate set tag-cache-ttl <seconds>`
+DEFAULT_TTL = 10 * 60
+
+# Set to ignore the on-disk cache the first time each repo is listed in this process
+force_refresh = False
+
+# Repos per GraphQL query in prefetch()
+GRAPHQL_BATCH = 50
+# Tags per repo in a GraphQL query. Repos with more are left for list_tags to page through with REST
+GRAPHQL_TAGS = 100
+
+_REPO_QUERY = """\
+{alias}: repository(owner: {owner}, name: {name}) {{
+    refs(refPrefix: "refs/tags/", first: {first}) {{
+      nodes {{ name target {{ oid ... on Tag {{ target {{ oid }} }} }} }}
+      pageInfo {{ hasNextPage }}
+    }}
+  }}"""
+
+_lock = threading.Lock()
+_refreshed: set[str] = set()
+# One lock per repo key, so that threads needing the same repo fetch its tags once, see list_tags
+_repo_locks: dict[str, threading.Lock] = {}
+
+
+def _key(username: str, reponame: str) -> str:
+    # GitHub usernames/reponames are case-insensitive
+    return f"{username.lower()}/{reponame.lower()}"
+
+
+def _cache_path(key: str):
+    # One file per repo, so that caching the tags of one repo doesn't rewrite those of every other
+    return APPDATA_FARETEK_CACHE / "tags" / f"{key}.json"
+
+
+def _repo_lock(key: str) -> threading.Lock:
+    with _lock:
+        return _repo_locks.setdefault(key, threading.Lock())
+
+
+def ttl() -> float:
+    return float(cookies.get("tag-cache-ttl", DEFAULT_TTL))
+
+
+def cached(username: str, reponame: str) -> Optional[dict[str, Any]]:
+    """
+    The cache entry ({"etag", "fetched", "tags"}) of a repo, however old it is
+    """
+    return read_json(_cache_path(_key(username, reponame)))
+
+
+def list_tags(username: str, reponame: str, *, refresh: bool = False) -> list[dict[str, str]]:
+    """
+    Get the tags of a repo, newest first, in the format [{"name": ..., "sha": ...}].
+    Served from the cache while it is younger than ttl(), otherwise revalidated with If-None-Match.
+    When offline, the cache is used however old it is.
+    Only one thread lists a repo at a time, and the others then find its tags in the cache.
+    :param refresh: ignore the cache completely
+    """
+    key = _key(username, reponame)
+    with _repo_lock(key):
+        return _list_tags(username, reponame, key, refresh)
+
+
+def _list_tags(username: str, reponame: str, key: str, refresh: bool) -> list[dict[str, str]]:
+    refresh = refresh or (force_refresh and key not in _refreshed)
+
+    entry = cached(username, reponame)
+
+    if entry and is_offline():
+        logging.info("Offline, so using cached tags for %s", key)
+        return entry["tags"]
+    ensure_online(f"tags of {key}")
+
+    if entry and not refresh and time.time() - entry["fetched"] < ttl():
+        logging.info("Using cached tags for %s", key)
+        return entry["tags"]
+
+    url = f"{api_base()}/repos/{username}/{reponame}/tags"
+    resp = request("GET", url, params={"per_page": 100},
+                   headers=api_headers(entry["etag"] if entry and not refresh else None))
+
+    if resp.status_code == 304:
+        logging.info("Tags for %s not modified", key)
+        tags = entry["tags"]
+    else:
+        resp.raise_for_status()
+        etag = resp.headers.get("ETag")
+
+        tags = []
+        while True:
+            tags += [{"name": tag["name"], "sha": tag["commit"]["sha"]} for tag in resp.json()]
+
+            if "next" not in resp.links:
+                break
+            resp = request("GET", resp.links["next"]["url"], headers=api_headers())
+            resp.raise_for_status()
+
+        logging.info("Fetched %d tags for %s", len(tags), key)
+        entry = {"etag": etag, "tags": tags}
+
+    entry["fetched"] = time.time()
+    with _lock:
+        _refreshed.add(key)
+    write_json(_cache_path(key), entry)
+
+    return tags
+
+
+def _needs_fetch(key: str, entry: Optional[dict[str, Any]]) -> bool:
+    if force_refresh and key not in _refreshed:
+        return True
+    return not entry or time.time() - entry["fetched"] >= ttl()
+
+
+def prefetch(repos: Iterable[tuple[str, str]]):
+    """
+    Fetch the tags of many repos at once, with one GraphQL query per GRAPHQL_BATCH repos, so that list_tags can then
+    answer from the cache. Repos that are already cached, missing, or have too many tags to fetch this way are left
+    for list_tags. Does nothing without an auth-token, because GitHub's GraphQL API needs one, or when offline
+    :param repos: (username, reponame) pairs
+    """
+    if is_offline() or not cookies.get("auth-token"):
+        return
+
+    todo = {}
+    for username, reponame in repos:
+        key = _key(username, reponame)
+        if key not in todo and _needs_fetch(key, read_json(_cache_path(key))):
+            todo[key] = username, reponame
+
+    todo = list(todo.items())
+    for start in range(0, len(todo), GRAPHQL_BATCH):
+        batch = todo[start:start + GRAPHQL_BATCH]
+        with profiler.phase("tags") as info:
+            info["repos"] = len(batch)
+            _prefetch_batch(batch)
+
+
+def _prefetch_batch(batch: list[tuple[str, tuple[str, str]]]):
+    import httpx
+
+    query = "query {\n  " + "\n  ".join(
+        _REPO_QUERY.format(alias=f"r{i}", owner=json.dumps(username), name=json.dumps(reponame), first=GRAPHQL_TAGS)
+        for i, (_, (username, reponame)) in enumerate(batch)) + "\n}"
+
+    try:
+        resp = request("POST", f"{api_base()}/graphql", json={"query": query}, headers=api_headers())
+        resp.raise_for_status()
+        result = resp.json()
+    except (httpx.HTTPError, ValueError) as e:
+        # list_tags will use REST instead
+        logging.warning("Could not prefetch tags with GraphQL: %r", e)
+        return
+
+    for error in result.get("errors") or []:
+        logging.info("GraphQL error while prefetching tags: %s", error.get("message"))
+
+    fetched = {}
+    for i, (key, _) in enumerate(batch):
+        repo = (result.get("data") or {}).get(f"r{i}")
+        if repo is None or repo["refs"]["pageInfo"]["hasNextPage"]:
+            continue
+
+        tags = []
+        for node in repo["refs"]["nodes"]:
+            target = node["target"]
+            # annotated tags point to a tag object, which points to the commit
+            tags.append({"name": node["name"], "sha": (target.get("target") or target)["oid"]})
+        fetched[key] = {"etag": None, "fetched": time.time(), "tags": tags}
+
+    logging.info("Prefetched tags of %d/%d repos with one GraphQL query", len(fetched), len(batch))
+
+    with _lock:
+        _refreshed.update(fetched)
+    for key, entry in fetched.items():
+        write_json(_cache_path(key), entry)
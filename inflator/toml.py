@@ -1,11 +1,11 @@
 from pathlib import Path
 
-from slugify import slugify
-
 from inflator.util import AURA
 
 
 def toml(cwd: Path = None):
+    from slugify import slugify
+
     if cwd is None:
         cwd = Path.cwd()
 
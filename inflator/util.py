@@ -1,14 +1,32 @@
 from __future__ import annotations
 
+import hashlib
+import json
 import os
 import sys
 import pathlib
 import shutil
 import stat
+import tempfile
+import threading
 
+from contextlib import contextmanager
 from typing import Final, Optional
 
 
+_print_lock = threading.Lock()
+
+
+def echo(*values, sep: str = " "):
+    """
+    print() for worker threads: each call is written as one piece, so lines from different threads don't get mixed
+    """
+    text = sep.join(map(str, values)) + "\n"
+    with _print_lock:
+        sys.stdout.write(text)
+        sys.stdout.flush()
+
+
 def ansi(code):
     return f"\u001b[{code}m"
 
@@ -29,7 +47,16 @@ APPDATA_FARETEK: Final[pathlib.Path] = _gen_appdata_folder()
 APPDATA_FARETEK_INFLATE: Final[pathlib.Path] = APPDATA_FARETEK / "inflate"
 APPDATA_FARETEK_COOKIES: Final[pathlib.Path] = APPDATA_FARETEK_INFLATE / "cookies.json"
 APPDATA_FARETEK_PKGS: Final[pathlib.Path] = APPDATA_FARETEK_INFLATE / "pkgs"
-APPDATA_FARETEK_ZIPAREA: Final[pathlib.Path] = APPDATA_FARETEK_INFLATE / "ziparea"
+APPDATA_FARETEK_CACHE: Final[pathlib.Path] = APPDATA_FARETEK_INFLATE / "cache"
+APPDATA_FARETEK_ZIPCACHE: Final[pathlib.Path] = APPDATA_FARETEK_CACHE / "zipballs"
+APPDATA_FARETEK_STORE: Final[pathlib.Path] = APPDATA_FARETEK_INFLATE / "store"
+
+# Block size for streaming downloads/extraction, so that memory use doesn't scale with archive size
+CHUNK_SIZE: Final[int] = 64 * 1024
+# Marks a sha256 of an installed tree (see tree_hash) rather than of a zipball
+TREE_HASH_PREFIX: Final[str] = "tree:"
+# Written into every installed package to say where it came from, so that the index can be rebuilt from the files
+SOURCE_FILE: Final[str] = ".inflator-source.json"
 
 GITHUB_REPO: Final[str] = "https://github.com/FAReTek1/inflator"
 AURA: Final[str] = "-9999 aura 💀"
@@ -38,10 +65,89 @@ ERROR_MSG: Final[str] = f"{ansi(31)}{AURA}{ansi(0)}\nFile an issue on github: {G
 
 def rmtree(path, ignore_errors=False):
     # https://stackoverflow.com/questions/58878089/how-to-remove-git-repository-in-python-on-windows
-    for root, dirs, files in os.walk(path):
-        for d in dirs:
-            os.chmod(os.path.join(root, d), stat.S_IRWXU)
-        for file in files:
-            os.chmod(os.path.join(root, file), stat.S_IRWXU)
+    # Only paths that can't be deleted are made writable. Installed files may be hardlinks to a package's source files,
+    # which shouldn't have their permissions changed just because an installation was removed
+    def onexc(func, p, exc):
+        if not isinstance(exc, PermissionError):
+            raise exc
+        os.chmod(os.path.dirname(p), stat.S_IRWXU)
+        os.chmod(p, stat.S_IRWXU)
+        func(p)
+
+    try:
+        shutil.rmtree(path, onexc=onexc)
+    except OSError:
+        if not ignore_errors:
+            raise
+
+
+def file_hash(path: pathlib.Path) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(CHUNK_SIZE):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def tree_hash(path: pathlib.Path) -> str:
+    """
+    Hash of the relative path and content of every file under path, so it doesn't depend on how they were written.
+    Prefixed with TREE_HASH_PREFIX, to tell it apart from the hash of a zipball. SOURCE_FILE isn't part of it
+    """
+    h = hashlib.sha256()
+    for relpath in sorted(file.relative_to(path).as_posix() for file in path.rglob("*")
+                          if file.is_file() and file.name != SOURCE_FILE):
+        h.update(f"{relpath}\0{file_hash(path / relpath)}\n".encode())
+    return TREE_HASH_PREFIX + h.hexdigest()
+
+
+def read_json(path: pathlib.Path, default=None):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return default
+
+
+def write_json(path: pathlib.Path, data, indent: Optional[int] = None, fsync: bool = False):
+    """
+    Write to a temporary file then rename over the original, so that readers never see a half-written file
+    :param fsync: flush the data to disk before renaming, so that a crash can't leave an empty file behind
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(prefix=f".{path.name}.", suffix=".tmp", dir=path.parent)
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=indent)
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
 
-    shutil.rmtree(path, ignore_errors=ignore_errors)
+@contextmanager
+def file_lock(path: pathlib.Path):
+    """
+    Exclusive lock between processes (and threads), held for the duration of the with block
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "a+b") as f:
+        if sys.platform == "win32":
+            import msvcrt
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+            try:
+                yield
+            finally:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
@@ -0,0 +1,145 @@
+# Ordering of tags, and version constraints. Tags are read as semver where possible ('v1.2.3', '1.2', 'v2.0.0-beta.1')
+from __future__ import annotations
+
+import fnmatch
+import functools
+import re
+
+from dataclasses import dataclass
+from typing import Iterable, Optional
+
+_VERSION_RE = re.compile(r"[vV]?(\d+)(?:\.(\d+))?(?:\.(\d+))?(?:[-+]?([0-9A-Za-z][0-9A-Za-z.-]*))?")
+_COMPARATOR_RE = re.compile(r"(>=|<=|>|<|==|=|\^|~)?\s*(\S+)")
+
+
+@dataclass(frozen=True)
+class Version:
+    major: int
+    minor: int
+    patch: int
+    # () for releases, which come after all of their prereleases
+    pre: tuple[tuple[int, int | str], ...]
+
+    @property
+    def is_prerelease(self):
+        return bool(self.pre)
+
+    def key(self):
+        # release (1,) sorts after prerelease (0, ...)
+        return self.major, self.minor, self.patch, (1,) if not self.pre else (0, *self.pre)
+
+
+@functools.cache
+def parse(tag: str) -> Optional[Version]:
+    """
+    Read a tag as a version. Missing minor/patch numbers are 0. None if it isn't a version at all
+    """
+    match = _VERSION_RE.fullmatch(tag.strip())
+    if match is None:
+        return None
+
+    major, minor, patch, pre = match.groups()
+    pre_key = tuple((0, int(p)) if p.isdigit() else (1, p) for p in pre.split('.')) if pre else ()
+    return Version(int(major), int(minor or 0), int(patch or 0), pre_key)
+
+
+def sort_key(tag: str):
+    """
+    Key to sort tags oldest to newest by version. Tags that aren't versions come before all that are, by name
+    """
+    version = parse(tag)
+    return (1, version.key(), tag) if version else (0, (), tag)
+
+
+def newest_first(tags: Iterable[str]) -> list[str]:
+    return sorted(tags, key=sort_key, reverse=True)
+
+
+def is_exact(spec: str) -> bool:
+    """
+    Whether a version spec names a single tag, rather than being a glob or a range
+    """
+    return not (any(c in spec for c in "*?[") or spec.lstrip()[:1] in ("^", "~", ">", "<", "=") or ',' in spec)
+
+
+@dataclass(frozen=True)
+class _Comparator:
+    op: str
+    version: Version
+
+    def __call__(self, version: Version) -> bool:
+        a, b = version.key(), self.version.key()
+        return {">=": a >= b, ">": a > b, "<=": a <= b, "<": a < b, "==": a == b}[self.op]
+
+
+@functools.cache
+def _comparators(spec: str) -> tuple[_Comparator, ...]:
+    """
+    ^1.2.3 -> >=1.2.3,<2.0.0 (<0.3.0 for ^0.2.3, <0.0.4 for ^0.0.3)
+    ~1.2.3 -> >=1.2.3,<1.3.0 (<2.0.0 for ~1)
+    Comparisons are separated by commas or spaces: '>=1.0, <2' or '>= 1.0 < 2'
+    """
+    ret = []
+    # a space only separates comparisons after a version, not between an operator and its version
+    for part in re.split(r"\s*,\s*|(?<=[\w.+-])\s+(?=[<>=^~\dvV])", spec.strip()):
+        match = _COMPARATOR_RE.fullmatch(part.strip())
+        version = parse(match[2]) if match else None
+        if version is None:
+            raise ValueError(f"Invalid version constraint {part!r} in {spec!r}")
+
+        op = match[1] or "=="
+        if op == "=":
+            op = "=="
+
+        if op == "^":
+            given = len(match[2].lstrip("vV").split('.'))
+            if version.major or given == 1:
+                upper = Version(version.major + 1, 0, 0, ())
+            elif version.minor or given == 2:
+                upper = Version(0, version.minor + 1, 0, ())
+            else:
+                upper = Version(0, 0, version.patch + 1, ())
+            ret += [_Comparator(">=", version), _Comparator("<", upper)]
+
+        elif op == "~":
+            if len(match[2].lstrip("vV").split('.')) == 1:
+                upper = Version(version.major + 1, 0, 0, ())
+            else:
+                upper = Version(version.major, version.minor + 1, 0, ())
+            ret += [_Comparator(">=", version), _Comparator("<", upper)]
+
+        else:
+            ret.append(_Comparator(op, version))
+
+    return tuple(ret)
+
+
+def matches(tag: str, spec: str) -> bool:
+    """
+    Whether a tag satisfies a version spec: an exact tag, a glob ('v1.*'), or a range ('^1.2', '~1.2.3',
+    '>=1.0,<2.0'). Ranges don't match prereleases unless the range itself mentions one
+    """
+    if any(c in spec for c in "*?["):
+        return fnmatch.fnmatch(tag, spec)
+    if is_exact(spec):
+        return tag == spec
+
+    version = parse(tag)
+    if version is None:
+        return False
+
+    comparators = _comparators(spec)
+    if version.is_prerelease and not any(c.version.is_prerelease for c in comparators):
+        return False
+
+    return all(c(version) for c in comparators)
+
+
+def best(tags: Iterable[str], spec: str) -> Optional[str]:
+    """
+    The newest tag that satisfies spec, if any
+    """
+    for tag in newest_first(tags):
+        if matches(tag, spec):
+            return tag
+    return None
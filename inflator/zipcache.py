@@ -0,0 +1,178 @@
+# Persistent, size-bounded cache of downloaded zipballs. Tags are immutable, so there is no need to download them twice
+from __future__ import annotations
+
+import logging
+import os
+import pathlib
+import shutil
+import threading
+import time
+
+from contextlib import contextmanager
+from typing import Optional, Iterator
+
+from inflator.cookies import cookies
+from inflator.util import APPDATA_FARETEK_ZIPCACHE, file_hash, file_lock, read_json, write_json
+
+# 1 GiB. Configure with `inflate set cache-max-size <bytes>`. 0 disables the cache
+DEFAULT_MAX_SIZE = 1024 ** 3
+
+_lock = threading.Lock()
+# entries that are currently being read in this process, so must not be evicted
+_pinned: set[str] = set()
+
+
+def _index_path():
+    return APPDATA_FARETEK_ZIPCACHE / "index.json"
+
+
+def _index_lock():
+    # Held around every read-modify-write of the index, so that concurrent inflate processes can't lose entries
+    return file_lock(APPDATA_FARETEK_ZIPCACHE / "index.lock")
+
+
+def _last_used(item: dict) -> float:
+    # Hits touch the zipball rather than rewriting the index, so its mtime is when it was last used
+    try:
+        return max(item["used"], (APPDATA_FARETEK_ZIPCACHE / item["file"]).stat().st_mtime)
+    except FileNotFoundError:
+        return item["used"]
+
+
+def _key(username: str, reponame: str, tag: str):
+    # GitHub usernames/reponames are case-insensitive
+    return f"{username.lower()}/{reponame.lower()}/{tag}"
+
+
+def max_size() -> int:
+    return int(cookies.get("cache-max-size", DEFAULT_MAX_SIZE))
+
+
+def entry(username: str, reponame: str, tag: str) -> Optional[dict]:
+    """
+    Metadata (file, sha256, size, last use) of a cached zipball, if there is one
+    """
+    with _lock:
+        return read_json(_index_path(), {}).get(_key(username, reponame, tag))
+
+
+def get(username: str, reponame: str, tag: str) -> Optional[tuple[pathlib.Path, str]]:
+    """
+    Look up a cached zipball. Entries whose file is missing or doesn't have the recorded size are dropped. The file
+    isn't hashed again, since it is named by its sha256 and only ever moved into place whole.
+    Marks the entry as recently used by touching the file, so hits don't write the index
+    :return: path and sha256 of the zipball
+    """
+    key = _key(username, reponame, tag)
+
+    with _lock:
+        item = read_json(_index_path(), {}).get(key)
+    if item is None:
+        return None
+
+    path = APPDATA_FARETEK_ZIPCACHE / item["file"]
+    try:
+        intact = path.stat().st_size == item["size"]
+    except FileNotFoundError:
+        intact = False
+
+    if intact:
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+    else:
+        logging.warning("Dropping corrupt cache entry %s: %s", key, item)
+        with _lock, _index_lock():
+            index = read_json(_index_path(), {})
+            if index.get(key) == item:
+                path.unlink(missing_ok=True)
+                del index[key]
+                write_json(_index_path(), index)
+        return None
+
+    logging.info("Cache hit for %s: %s", key, path)
+    return path, item["sha256"]
+
+
+def put(username: str, reponame: str, tag: str, download: pathlib.Path, sha256: str) -> Optional[pathlib.Path]:
+    """
+    Move a downloaded zipball into the cache, then evict least recently used entries until it fits in max_size().
+    :return: the new path of the zipball, or None if it was not cached (in which case download is left where it is)
+    """
+    limit = max_size()
+    size = download.stat().st_size
+    if size > limit:
+        logging.info("Not caching %s: %d bytes is bigger than the limit of %d", download, size, limit)
+        return None
+
+    key = _key(username, reponame, tag)
+    path = APPDATA_FARETEK_ZIPCACHE / f"{sha256}.zip"
+
+    with _lock, _index_lock():
+        APPDATA_FARETEK_ZIPCACHE.mkdir(parents=True, exist_ok=True)
+        shutil.move(download, path)
+
+        index = read_json(_index_path(), {})
+        index[key] = {"file": path.name, "sha256": sha256, "size": size, "used": time.time()}
+        _evict(index, limit, keep={key})
+        write_json(_index_path(), index)
+        _sweep(index)
+
+    logging.info("Cached %s as %s", key, path)
+    return path
+
+
+def _evict(index: dict[str, dict], limit: int, keep: set[str]):
+    total = sum(item["size"] for item in index.values())
+
+    for key in sorted(index, key=lambda k: _last_used(index[k])):
+        if total <= limit:
+            break
+        if key in keep or key in _pinned:
+            continue
+
+        item = index.pop(key)
+        total -= item["size"]
+
+        # Identical archives may be stored under multiple tags, so only remove the file when nothing else uses it
+        if not any(other["file"] == item["file"] for other in index.values()):
+            (APPDATA_FARETEK_ZIPCACHE / item["file"]).unlink(missing_ok=True)
+        logging.info("Evicted %s from zipball cache", key)
+
+
+def _sweep(index: dict[str, dict]):
+    # Delete zipballs that no entry refers to, e.g. left behind by a process that crashed before updating the index.
+    # Only called with the index lock held, so no other process is between moving a zipball in and recording it
+    files = {item["file"] for item in index.values()}
+    for path in APPDATA_FARETEK_ZIPCACHE.glob("*.zip"):
+        if path.name not in files:
+            logging.info("Deleting orphaned %s from zipball cache", path)
+            path.unlink(missing_ok=True)
+
+
+@contextmanager
+def zipball(pkg) -> Iterator[tuple[pathlib.Path, str]]:
+    """
+    Yield the path and sha256 of the zipball of a gh package with a resolved version, downloading it if it isn't
+    cached. The entry is kept from being evicted while in use
+    """
+    key = _key(pkg.username, pkg.reponame, pkg.version)
+
+    with _lock:
+        _pinned.add(key)
+    try:
+        cached = get(pkg.username, pkg.reponame, pkg.version)
+        if cached is not None:
+            yield cached
+            return
+
+        download = pkg.fetch_data()
+        try:
+            sha256 = file_hash(download)
+            yield put(pkg.username, pkg.reponame, pkg.version, download, sha256) or download, sha256
+        finally:
+            download.unlink(missing_ok=True)
+    finally:
+        with _lock:
+            _pinned.discard(key)